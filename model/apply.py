@@ -0,0 +1,279 @@
+import base64
+import hashlib
+import json
+import logging
+import re
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, List
+
+import yaml
+
+from . import exceptions
+from . import process
+from . import render
+
+log = logging.getLogger(__name__)
+
+# Outputs are named with a numeric prefix ordering them, 00- namespaces,
+# 10- storage classes, 40- deployments, 50-/70- services ...
+WAVE_RE = re.compile(r"^(?P<wave>\d+)-")
+# Outputs without a prefix (pull secrets, kustomize generated config maps and
+# secrets) are applied before the workloads referencing them
+DEFAULT_WAVE = 30
+GENERATED = "<generated>"
+# kubectl apply run at once within a wave
+DEFAULT_PARALLEL = 4
+APPLY_TIMEOUT = 5 * 60
+WAIT_TIMEOUT = 2 * 60
+KUSTOMIZATION = "kustomization.yaml"
+GENERATORS = {"configMapGenerator": "ConfigMap", "secretGenerator": "Secret"}
+# keys of the objects referencing a config map or secret by name
+REFERENCES = {
+    "configMap": "ConfigMap",
+    "configMapRef": "ConfigMap",
+    "configMapKeyRef": "ConfigMap",
+    "secret": "Secret",
+    "secretRef": "Secret",
+    "secretKeyRef": "Secret",
+}
+# Kinds later waves can only use once the objects are ready, other objects
+# are usable as soon as the API server accepted them
+READY_CONDITIONS = {
+    "Namespace": "jsonpath={.status.phase}=Active",
+    "CustomResourceDefinition": "condition=Established",
+}
+
+
+def wave_of(name):
+    m = WAVE_RE.match(Path(name).name)
+    return int(m.group("wave")) if m else DEFAULT_WAVE
+
+
+@dataclass
+class Manifest:
+    """Documents applied with one kubectl call, name is the output they came from"""
+
+    name: str
+    docs: List[Any] = field(default_factory=list)
+    wave: int = None
+
+    def __post_init__(self):
+        if self.wave is None:
+            self.wave = wave_of(self.name)
+
+
+def waves(manifests):
+    """[(wave, [Manifest, ...]), ...] in the order they are applied"""
+    grouped = {}
+    for manifest in manifests:
+        if manifest.docs:
+            grouped.setdefault(manifest.wave, []).append(manifest)
+    return sorted(grouped.items())
+
+
+def _key(doc):
+    md = doc.get("metadata") or {}
+    return (doc.get("kind"), md.get("namespace"), md.get("name"))
+
+
+def _load(text):
+    return [d for d in yaml.safe_load_all(text) if d]
+
+
+def from_directory(directory, kubectl="kubectl"):
+    """Manifests of a DirectoryRenderer output.
+
+    A kustomization is built with kubectl (resolving its generators) and each
+    built document put in the wave of the resource file it came from.
+    """
+    directory = Path(directory)
+    kfn = directory / KUSTOMIZATION
+    if not kfn.exists():
+        return [
+            Manifest(fn.name, _load(fn.read_text(encoding="utf-8")))
+            for fn in sorted(directory.glob("*.yaml"))
+        ]
+    kustomization = yaml.safe_load(kfn.read_text(encoding="utf-8")) or {}
+    manifests = {GENERATED: Manifest(GENERATED, wave=DEFAULT_WAVE)}
+    sources = {}
+    for name in kustomization.get("resources") or []:
+        manifests[name] = Manifest(name)
+        for doc in _load((directory / name).read_text(encoding="utf-8")):
+            sources[_key(doc)] = name
+
+    result = process.run([kubectl, "kustomize", str(directory)])
+    if result.returncode != 0:
+        raise exceptions.ModelError(
+            f"unable to build {directory}: {result.stderr.strip()}"
+        )
+    for doc in _load(result.stdout):
+        manifests[sources.get(_key(doc), GENERATED)].docs.append(doc)
+    return list(manifests.values())
+
+
+def name_hash(doc):
+    """The content hash kustomize suffixes a generated object's name with"""
+    data = {"kind": doc["kind"], "name": doc["metadata"]["name"], "data": doc["data"]}
+    if doc["kind"] == "Secret":
+        data["type"] = doc["type"]
+    # encoded as go's json.Marshal does
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    for c in "<>&":
+        text = text.replace(c, f"\\u{ord(c):04x}")
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:10]
+    return digest.translate(str.maketrans("013ae", "ghkmt"))
+
+
+def _generate(kind, generator, outputs):
+    data = {}
+    for item in generator.get("literals") or []:
+        key, _, value = item.partition("=")
+        data[key] = value
+    for item in generator.get("files") or []:
+        key, _, fn = item.rpartition("=")
+        ent = outputs.index.get(fn)
+        if ent is None:
+            raise exceptions.ModelError(
+                f"{kind} {generator['name']} is missing its file {fn}"
+            )
+        data[key or Path(fn).name] = render.serialize(ent)
+    doc = dict(apiVersion="v1", kind=kind, metadata=dict(name=generator["name"]))
+    if generator.get("namespace"):
+        doc["metadata"]["namespace"] = generator["namespace"]
+    if kind == "Secret":
+        doc["type"] = generator.get("type", "Opaque")
+        data = {
+            k: base64.b64encode(v.encode("utf-8")).decode("ascii")
+            for k, v in data.items()
+        }
+    doc["data"] = data
+    doc["metadata"]["name"] += f"-{name_hash(doc)}"
+    return doc
+
+
+def _rename_references(node, namespace, renames):
+    if isinstance(node, list):
+        for item in node:
+            _rename_references(item, namespace, renames)
+        return
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        if key == "imagePullSecrets" and isinstance(value, list):
+            refs = [("Secret", ref) for ref in value if isinstance(ref, dict)]
+        elif key in REFERENCES and isinstance(value, dict):
+            refs = [(REFERENCES[key], value)]
+        else:
+            refs = []
+        for kind, ref in refs:
+            for field_name in ("name", "secretName"):
+                new = renames.get((kind, namespace, ref.get(field_name)))
+                if new:
+                    ref[field_name] = new
+        _rename_references(value, namespace, renames)
+
+
+def from_outputs(outputs):
+    """Manifests of the outputs of a Renderer held in memory.
+
+    The config maps and secrets of a kustomization's generators are made
+    in-process, named and referenced as `kubectl kustomize` would.
+    """
+    kustomization = outputs.index.get(KUSTOMIZATION)
+    if kustomization is None:
+        names = [
+            e.name
+            for e in outputs
+            if e.annotations.get("format", "yaml") == "yaml" and "/" not in e.name
+        ]
+        kustomization = dict(resources=sorted(names))
+    else:
+        kustomization = kustomization.data
+    manifests = []
+    for name in kustomization.get("resources") or []:
+        ent = outputs.index[name]
+        fmt = ent.annotations.get("format", "yaml")
+        docs = render.parse(render.serialize(ent), fmt)
+        manifests.append(Manifest(name, [d for d in docs if d]))
+
+    generated = Manifest(GENERATED, wave=DEFAULT_WAVE)
+    renames = {}
+    for key, kind in GENERATORS.items():
+        for generator in kustomization.get(key) or []:
+            doc = _generate(kind, generator, outputs)
+            key = (kind, generator.get("namespace"), generator["name"])
+            renames[key] = doc["metadata"]["name"]
+            generated.docs.append(doc)
+    for manifest in manifests:
+        for doc in manifest.docs:
+            namespace = (doc.get("metadata") or {}).get("namespace")
+            _rename_references(doc, namespace, renames)
+    return [generated] + manifests
+
+
+class WaveApplier:
+    """Apply manifests wave by wave, the manifests of a wave concurrently.
+
+    The next wave starts once every manifest of the current one is applied
+    and, for the kinds in READY_CONDITIONS, its objects are ready.
+    """
+
+    def __init__(self, max_parallel=DEFAULT_PARALLEL, kubectl="kubectl"):
+        self.max_parallel = max_parallel or DEFAULT_PARALLEL
+        self.kubectl = kubectl
+
+    def apply(self, manifests):
+        planned = waves(manifests)
+        for i, (wave, group) in enumerate(planned):
+            log.info(f"applying wave {wave}: {', '.join(m.name for m in group)}")
+            if not self._apply_wave(group):
+                log.error(f"wave {wave} failed, not applying later waves")
+                return False
+            if i + 1 < len(planned) and not self._wait_ready(group):
+                return False
+        return True
+
+    def _apply_wave(self, group):
+        calls = [
+            (
+                [self.kubectl, "apply", "-f", "-"],
+                dict(input=yaml.safe_dump_all(m.docs), timeout=APPLY_TIMEOUT),
+            )
+            for m in group
+        ]
+        results = process.run_many(calls, max_concurrency=self.max_parallel)
+        ok = True
+        for manifest, result in zip(group, results):
+            if isinstance(result, Exception):
+                log.error(f"applying {manifest.name} resulted in error: {result}")
+                ok = False
+            elif result.returncode != 0:
+                log.error(f"applying {manifest.name} failed: {result.stderr.strip()}")
+                ok = False
+            else:
+                for line in result.stdout.splitlines():
+                    log.info(line)
+        return ok
+
+    def _wait_ready(self, group):
+        waits = {}
+        for manifest in group:
+            for doc in manifest.docs:
+                condition = READY_CONDITIONS.get(doc.get("kind"))
+                if condition:
+                    name = f"{doc['kind'].lower()}/{doc['metadata']['name']}"
+                    waits.setdefault(condition, []).append(name)
+        for condition, names in waits.items():
+            cmd = [self.kubectl, "wait", f"--for={condition}"]
+            cmd += [f"--timeout={WAIT_TIMEOUT}s", *names]
+            try:
+                result = process.run(cmd, timeout=WAIT_TIMEOUT + 30)
+            except subprocess.TimeoutExpired:
+                log.error(f"timed out waiting for {names}")
+                return False
+            if result.returncode != 0:
+                log.error(f"waiting for {names} failed: {result.stderr.strip()}")
+                return False
+        return True
@@ -0,0 +1,259 @@
+import logging
+from pathlib import Path
+
+import yaml
+
+from . import __version__
+from . import utils
+from .runtime import render_context
+
+log = logging.getLogger(__name__)
+
+
+class Uncacheable(Exception):
+    pass
+
+
+def _check_plain(data):
+    # Only plain data can be replayed faithfully, anything else
+    # (model objects, tuples, ...) makes the call uncacheable
+    if isinstance(data, dict):
+        for k, v in data.items():
+            if not isinstance(k, str):
+                raise Uncacheable(f"non string key {k!r}")
+            _check_plain(v)
+    elif isinstance(data, list):
+        for v in data:
+            _check_plain(v)
+    elif not (data is None or isinstance(data, (str, bytes, int, float, bool))):
+        raise Uncacheable(f"unable to encode {type(data)}")
+    return data
+
+
+class RecordingRenderer:
+    """Proxy a Renderer recording the add/update calls made by a plugin so they
+    can be replayed later."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.calls = []
+
+    def add(self, name, data, plugin, ignore_existing=False, **kwargs):
+        self.calls.append(("add", name, data, ignore_existing, kwargs))
+        return self.outputs.add(
+            name, data, plugin, ignore_existing=ignore_existing, **kwargs
+        )
+
+    def update(self, name, data, plugin, schema=None, **kwargs):
+        self.calls.append(("update", name, data, schema, kwargs))
+        return self.outputs.update(name, data, plugin, schema=schema, **kwargs)
+
+    def __contains__(self, key):
+        return key in self.outputs
+
+    def __iter__(self):
+        return iter(self.outputs)
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __getattr__(self, key):
+        return getattr(self.outputs, key)
+
+
+class RenderCache:
+    """Content addressed cache of the outputs produced by Plugin.render_service.
+
+    Each cacheable plugin/service pair is fingerprinted from the service's
+    resolved inputs. When a fingerprint was seen before the recorded output
+    calls are replayed instead of rendering the service again.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        # entries used by the current render, the others are pruned
+        self.used = set()
+
+    @classmethod
+    def for_output(cls, output_dir):
+        if str(output_dir) == "-":
+            return cls(Path(".model-render-cache").absolute())
+        output_dir = Path(output_dir).absolute()
+        return cls(output_dir.parent / f".{output_dir.name}-render-cache")
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return self.hits / total
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, hit_rate=self.hit_rate)
+
+    def _template_sources(self, service, files):
+        sources = []
+        for filespec in files:
+            name = filespec.get("template")
+            if not name:
+                continue
+            template = service.get_template(name)
+            env = template.environment
+            source = env.loader.get_source(env, template.filename)[0]
+            sources.append([template.filename, source])
+        return sources
+
+    def fingerprint(self, plugin, service, graph):
+        ctx = render_context(service)
+        cls = plugin.__class__
+        env_config = dict(graph.environment.config)
+        # Per service environment config is part of the resolved service config
+        env_config.pop("services", None)
+        inputs = dict(
+            plugin=f"{cls.__module__}.{cls.__qualname__}",
+            version=getattr(plugin, "version", __version__),
+            plugin_config=plugin.config,
+            graph=graph.name,
+            environment=env_config,
+            service=service.entity.serialized(),
+            image=service.image,
+            config=ctx.config,
+            relations=ctx.relations,
+            secrets=ctx.secrets,
+            templates=self._template_sources(service, ctx.files),
+        )
+        m = getattr(plugin, "cache_key", None)
+        if m:
+            inputs["extra"] = m(service, graph)
+        return utils.fingerprint(inputs)
+
+    def _entry_path(self, key):
+        return self.path / key[:2] / f"{key}.yaml"
+
+    def load(self, key):
+        fn = self._entry_path(key)
+        if not fn.exists():
+            return None
+        try:
+            # yaml (rather than json) keeps bytes and objects shared between
+            # documents intact, so replayed output is identical
+            return yaml.safe_load(fn.read_text(encoding="utf-8"))
+        except yaml.YAMLError:
+            log.warning(f"Ignoring corrupt render cache entry {fn}")
+            return None
+
+    def save(self, key, calls):
+        fn = self._entry_path(key)
+        fn.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fn.with_suffix(".tmp")
+        tmp.write_text(yaml.dump(calls, sort_keys=False), encoding="utf-8")
+        tmp.replace(fn)
+
+    def _encode_annotations(self, annotations, service, graph):
+        result = {}
+        for k, v in annotations.items():
+            if v is service:
+                result[k] = {"$ref": "service"}
+            elif v is graph:
+                result[k] = {"$ref": "graph"}
+            elif getattr(v, "kind", None) == "Endpoint" and v.service is service:
+                result[k] = {"$ref": "endpoint", "name": v.name}
+            elif v is None or isinstance(v, (str, int, float, bool)):
+                result[k] = v
+            else:
+                raise Uncacheable(f"unable to encode annotation {k}")
+        return result
+
+    def _decode_annotations(self, annotations, service, graph):
+        result = {}
+        for k, v in annotations.items():
+            if isinstance(v, dict):
+                ref = v["$ref"]
+                if ref == "service":
+                    v = service
+                elif ref == "graph":
+                    v = graph
+                elif ref == "endpoint":
+                    v = service.endpoints[v["name"]]
+            result[k] = v
+        return result
+
+    def _encode_calls(self, calls, service, graph):
+        encoded = []
+        for op, name, data, option, kwargs in calls:
+            encoded.append(
+                dict(
+                    op=op,
+                    name=name,
+                    data=_check_plain(data),
+                    option=_check_plain(option),
+                    annotations=self._encode_annotations(kwargs, service, graph),
+                )
+            )
+        return encoded
+
+    def replay(self, calls, plugin, service, graph, outputs):
+        for call in calls:
+            data = call["data"]
+            kwargs = self._decode_annotations(call["annotations"], service, graph)
+            if call["op"] == "add":
+                outputs.add(
+                    call["name"], data, plugin, ignore_existing=call["option"], **kwargs
+                )
+            else:
+                outputs.update(
+                    call["name"], data, plugin, schema=call["option"], **kwargs
+                )
+
+    def render_service(self, plugin, method, service, graph, outputs):
+        """Call method(service, graph, outputs) unless a cached result can be replayed."""
+        try:
+            key = self.fingerprint(plugin, service, graph)
+        except (TypeError, ValueError) as e:
+            log.debug(f"Unable to fingerprint {service.name} for {plugin.name}: {e}")
+            return method(service, graph, outputs)
+
+        self.used.add(key)
+        calls = self.load(key)
+        if calls is not None:
+            self.hits += 1
+            log.debug(f"render cache hit {plugin.name}:{service.name}")
+            self.replay(calls, plugin, service, graph, outputs)
+            return
+
+        self.misses += 1
+        recorder = RecordingRenderer(outputs)
+        method(service, graph, recorder)
+        # Save right away, later phases and plugins may still modify these outputs
+        try:
+            calls = self._encode_calls(recorder.calls, service, graph)
+        except Uncacheable as e:
+            log.debug(f"Not caching {plugin.name}:{service.name}: {e}")
+            return
+        self.save(key, calls)
+
+    def prune(self):
+        """Remove the entries the current render didn't use, returning their number"""
+        if not self.path.exists():
+            return 0
+        pruned = 0
+        for fn in self.path.glob("*/*.yaml"):
+            if fn.stem not in self.used:
+                fn.unlink()
+                pruned += 1
+        for d in self.path.iterdir():
+            if d.is_dir() and not any(d.iterdir()):
+                d.rmdir()
+        return pruned
+
+    def clear(self):
+        if not self.path.exists():
+            return
+        for fn in sorted(self.path.rglob("*"), reverse=True):
+            if fn.is_dir():
+                fn.rmdir()
+            else:
+                fn.unlink()
+        self.path.rmdir()
@@ -1,21 +1,17 @@
 import logging
 import os
-import subprocess
-import tempfile
+import sys
 from pathlib import Path
 
 import click
-from rich.traceback import install as install_rich_tb
-
-from .. import entity, exceptions
-from .. import graph as graph_manager
-from .. import model, pipeline
-from .. import render as render_impl
-from .. import runtime as runtime_impl
-from .. import schema, server, store, utils
+
+from .. import exceptions
 from ..config import get_model_config, _set_model_config
 from .clicktools import spec, using
 
+# Subcommands import the modules they need when they run, keeping startup
+# (and `model --help`) from paying for aiohttp, rich and friends.
+
 cmd_name = __package__.split(".")[0]
 log = logging.getLogger(cmd_name)
 
@@ -33,10 +29,18 @@ common_args = [
 ]
 
 
+def _rich_excepthook(*exc_info):
+    # Only pay for importing rich when there is a traceback to show
+    from rich.traceback import install as install_rich_tb
+
+    install_rich_tb()
+    sys.excepthook(*exc_info)
+
+
 @click.group()
 @using(common_args)
 def main(config, **kwargs):
-    install_rich_tb()
+    sys.excepthook = _rich_excepthook
 
 
 @main.group()
@@ -49,7 +53,48 @@ def pipeline(config, **kwargs):
 @using(common_args)
 @click.argument("pipeline_name")
 @click.argument("segment", required=False, default=None, nargs=-1)
-def run(config, pipeline_name, segment, **kwargs):
+@click.option(
+    "-j", "--jobs", type=int, default=None, help="Segments run at once (default 4)"
+)
+@click.option(
+    "--continue-on-error",
+    is_flag=True,
+    default=None,
+    help="Keep running segments not depending on a failed one",
+)
+@click.option(
+    "--force", is_flag=True, help="Run segments even when their inputs are unchanged"
+)
+@click.option(
+    "--resume", is_flag=True, help="Skip the segments completed by the last run"
+)
+@click.option(
+    "--state/--no-state",
+    default=True,
+    help="Keep segment fingerprints and checkpoints (skipping unchanged segments)",
+)
+@click.option(
+    "--trace",
+    "trace_file",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="JSON lines file to append timing spans to (by default next to the state)",
+)
+def run(
+    config,
+    pipeline_name,
+    segment,
+    jobs,
+    continue_on_error,
+    force,
+    resume,
+    state,
+    trace_file,
+    **kwargs,
+):
+    from .. import pipeline as pipeline_impl
+    from .. import trace
+
     # First load in the graph references from config
     # then fine the pipeline object referenced by name
     # trigger the pipeline using the graph
@@ -62,13 +107,85 @@ def run(config, pipeline_name, segment, **kwargs):
         raise exceptions.ConfigurationError(
             f"unable to find a pipeline {pipeline_name}. Aborting."
         )
-    pipeline.run(config.store, config.environment, segments=segment)
+    on_failure = pipeline_impl.CONTINUE if continue_on_error else None
+    if state:
+        state = pipeline_impl.PipelineState.for_pipeline(
+            config.cache_dir, pipeline, config.environment
+        )
+    elif resume:
+        raise click.UsageError("--resume needs the pipeline state, drop --no-state")
+    else:
+        state = None
+    if not trace_file and state is not None:
+        trace_file = state.path.with_suffix(".trace.jsonl")
+    # without state nothing is written next to it, spans only make the summary
+    tracer = trace.Tracer(trace_file, pipeline=pipeline.name)
+    status = pipeline.run(
+        config.store,
+        config.environment,
+        segments=segment,
+        max_workers=jobs,
+        on_failure=on_failure,
+        state=state,
+        force=force,
+        resume=resume,
+        tracer=tracer,
+    )
+    click.echo(tracer.summary(), err=True)
+    if trace_file:
+        log.info(f"trace written to {trace_file}")
+    failed = [name for name, result in status.items() if result == "failed"]
+    if failed:
+        log.error(f"pipeline {pipeline_name} failed in segments {failed}")
+        sys.exit(1)
 
 
 graph_common = [
     spec("-e", "--environment"),
 ]
 
+render_common = [
+    spec(
+        "--cache/--no-cache",
+        "use_cache",
+        default=False,
+        help="Replay unchanged services from a render cache next to the output dir",
+    ),
+    spec(
+        "--pin-digests/--no-pin-digests",
+        default=False,
+        help="Resolve service images to registry digests before rendering",
+    ),
+]
+
+
+def _render_cache(output_dir, use_cache):
+    from .. import cache as cache_impl
+
+    if not use_cache:
+        return None
+    return cache_impl.RenderCache.for_output(output_dir)
+
+
+def _pin_digests(config, graph, pin_digests):
+    from .. import digest
+
+    if not pin_digests:
+        return
+    digests = digest.pin_images(graph, digest.resolver_for(config))
+    log.info(f"pinned {len(digests)} images to digests")
+
+
+def _report_cache(render_cache):
+    if render_cache is None:
+        return
+    pruned = render_cache.prune()
+    stats = render_cache.stats()
+    log.info(
+        f"render cache {render_cache.path}: {stats['hits']} hits, "
+        f"{stats['misses']} misses ({stats['hit_rate']:.0%}), {pruned} pruned"
+    )
+
 
 @main.group()
 @using(common_args, graph_common)
@@ -79,6 +196,8 @@ def graph(config, **kwargs):
 @graph.command()
 @using(common_args, graph_common)
 def plan(config, **kwargs):
+    from .. import graph as graph_manager
+
     config.init()
     graphs = config.store.graph.values()
     for graph in graphs:
@@ -87,49 +206,102 @@ def plan(config, **kwargs):
 
 
 @graph.command()
-@using(common_args, graph_common)
+@using(common_args, graph_common, render_common)
 @click.option("-o", "--output-dir", default="-")
-def render(config, output_dir, **kwargs):
+@click.option(
+    "--diff",
+    "diff_dir",
+    default=None,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, readable=True),
+    help="Only output manifests added or changed relative to a previous render",
+)
+def render(config, output_dir, use_cache, pin_digests, diff_dir, **kwargs):
+    from .. import graph as graph_manager
+    from .. import render as render_impl
+
     config.init()
     graphs = config.store.graph.values()
     # Apply should be graph at a time
     # or at least a single runtime
 
-    if output_dir == "-":
+    if diff_dir:
+        ren = render_impl.DiffRenderer(output_dir, previous=diff_dir)
+    elif output_dir == "-":
         ren = render_impl.FileRenderer(output_dir)
     else:
         ren = render_impl.DirectoryRenderer(output_dir)
 
+    render_cache = _render_cache(output_dir, use_cache)
     for graph in graphs:
         graph = graph_manager.plan(graph, config.store, environment=config.environment)
-        graph_manager.apply(graph, config.store, config.runtime, ren)
+        _pin_digests(config, graph, pin_digests)
+        graph_manager.apply(
+            graph, config.store, config.runtime, ren, cache=render_cache
+        )
+    _report_cache(render_cache)
+    if diff_dir:
+        summary = ren.summary
+        click.echo(
+            f"{len(summary['added'])} added, {len(summary['changed'])} changed, "
+            f"{len(summary['removed'])} removed, {summary['unchanged']} unchanged",
+            err=True,
+        )
+        for key in ["added", "changed", "removed"]:
+            for name in summary[key]:
+                click.echo(f"  {key}: {name}", err=True)
 
 
 @graph.command()
-@using(common_args, graph_common)
+@using(common_args, graph_common, render_common)
 @click.option("-o", "--output-dir", default=None)
-def up(config, output_dir, **kwargs):
+@click.option(
+    "-j", "--jobs", type=int, default=None, help="Manifests applied at once per wave"
+)
+def up(config, output_dir, use_cache, pin_digests, jobs, **kwargs):
+    from .. import apply as apply_impl
+    from .. import graph as graph_manager
+    from .. import render as render_impl
+
     config.init()
     graphs = config.store.graph.values()
     # Apply should be graph at a time
     # or at least a single runtime
 
-    if not output_dir:
-        output_dir = tempfile.mkdtemp("-base", prefix="model-")
+    if output_dir:
         log.info(f"Rendering model output to {output_dir}")
+        ren = render_impl.DirectoryRenderer(output_dir)
 
-    ren = render_impl.DirectoryRenderer(output_dir)
-
+    applier = apply_impl.WaveApplier(max_parallel=jobs)
+    ok = True
+    render_cache = _render_cache(output_dir or "-", use_cache)
     for graph in graphs:
         graph = graph_manager.plan(graph, config.store, environment=config.environment)
-        graph_manager.apply(graph, config.store, config.runtime, ren)
-    subprocess.run(f"kubectl apply -k {output_dir}", shell=True)
+        _pin_digests(config, graph, pin_digests)
+        if not output_dir:
+            # without an output dir each graph is applied from memory
+            # as soon as it is rendered
+            ren = render_impl.MemoryRenderer()
+        graph_manager.apply(
+            graph, config.store, config.runtime, ren, cache=render_cache
+        )
+        if not output_dir:
+            ok = applier.apply(apply_impl.from_outputs(ren))
+            if not ok:
+                break
+    _report_cache(render_cache)
+    if output_dir:
+        ok = applier.apply(apply_impl.from_directory(output_dir))
+    if not ok:
+        sys.exit(1)
 
 
 @graph.command()
 @using(common_args)
 @click.option("--update/--no-update", default=False)
 def develop(config, update, **kwargs):
+    from .. import graph as graph_manager
+    from .. import server
+
     config.init()
     # launch a development server for testing
     graphs = []
@@ -155,9 +327,13 @@ def shell(config, **kwargs):
     import atexit
     import code
     import readline
-    import sys
     from jedi.utils import setup_readline
 
+    from .. import graph as graph_manager
+    from .. import render as render_impl
+    from .. import runtime as runtime_impl
+    from .. import utils
+
     histfile_name = ".python_history"
 
     config.init()
@@ -225,5 +401,46 @@ def shell(config, **kwargs):
     code.interact(banner, local=ns)
 
 
+@main.group(name="cache")
+@using(common_args)
+def cache_group(config, **kwargs):
+    pass
+
+
+@cache_group.command()
+@using(common_args)
+@click.option(
+    "-o",
+    "--output-dir",
+    multiple=True,
+    help="Also clear the render cache kept for this output dir",
+)
+@click.option(
+    "--pipelines",
+    is_flag=True,
+    help="Also clear the pipeline fingerprints and checkpoints",
+)
+def clear(config, output_dir, pipelines, **kwargs):
+    import shutil
+
+    from .. import cache as cache_impl
+
+    config.setup_logging()
+    # the cache dir also holds pipeline state, only clear the caches
+    names = ["templates", "http", "digests.json"]
+    if pipelines:
+        names.append("pipelines")
+    paths = [config.cache_dir / name for name in names]
+    paths.extend(cache_impl.RenderCache.for_output(o).path for o in output_dir)
+    for path in paths:
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+        else:
+            continue
+        log.info(f"cleared {path}")
+
+
 if __name__ == "__main__":
     main(prog_name="model", auto_envvar_prefix="MODEL")
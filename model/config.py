@@ -1,25 +1,34 @@
 import logging
+import os
 import threading
 from pathlib import Path
 
 import click
-import coloredlogs
 import yaml
 
-from . import runtime as runtime_impl
-from . import schema, server, store, utils
+from . import store, utils
 
 cmd_name = __package__.split(".")[0]
 log = logging.getLogger(cmd_name)
 
+_unset = object()
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(base) / cmd_name
+
 
 class ModelConfig:
     def __init__(self):
         self.store = store.Store()
         self._environment = None
         self._context = utils.MergingChainMap()
+        self._model_conf = None
 
     def get_runtime(self, name=None):
+        from . import runtime as runtime_impl
+
         if not self.store:
             return
         rts = list(self.store.runtime.keys())
@@ -70,6 +79,8 @@ class ModelConfig:
         return default
 
     def setup_logging(self):
+        import coloredlogs
+
         level = self.find("log_level").upper()
         logging.basicConfig(level=level)
 
@@ -111,19 +122,47 @@ class ModelConfig:
         conf = yaml.safe_load(text)
         return conf
 
+    @property
+    def model_conf(self):
+        # see if there is  [~/.model.conf', '.model.conf']
+        if self._model_conf is None:
+            paths = filter(
+                lambda p: p.exists(),
+                [Path("~/.model.conf").expanduser(), Path(".model.conf")],
+            )
+            self._model_conf = [self.parse_model_config(p) or {} for p in paths]
+        return self._model_conf
+
+    def setting(self, name, default=None):
+        """Lookup a dotted setting, .model.conf overrides ~/.model.conf"""
+        for conf in reversed(self.model_conf):
+            val = utils.prop_get(conf, name, _unset)
+            if val is not _unset:
+                return val
+        return default
+
+    @property
+    def cache_dir(self):
+        return Path(self.setting("cache.dir") or default_cache_dir()).expanduser()
+
+    def setup_caches(self):
+        from . import template
+
+        if self.setting("cache.templates", True):
+            template.enable_bytecode_cache(self.cache_dir / "templates")
+        if self.setting("cache.http", True):
+            template.enable_http_cache(self.cache_dir / "http")
+
     def load_configs(self):
+        # Importing model and pipeline registers their kinds with the schema
+        from . import model, pipeline, schema  # noqa
+
         cd = self.find("config_dir")
         if not cd:
             return
         cd = list(cd)
 
-        # see if there is  [~/.model.conf', '.model.conf']
-        paths = filter(
-            lambda p: p.exists(),
-            [Path("~/.model.conf").expanduser(), Path(".model.conf")],
-        )
-        for p in paths:
-            conf = self.parse_model_config(p)
+        for conf in self.model_conf:
             bases = conf.get("bases")
             if bases:
                 for b in reversed(bases):
@@ -134,6 +173,7 @@ class ModelConfig:
 
     def init(self):
         self.setup_logging()
+        self.setup_caches()
         self.load_configs()
         # The graph can define a default runtime but any service in the graph could specify another
         # the idea of what a runtime is belongs to the imported Runtime object of the name referenced
@@ -0,0 +1,210 @@
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import docker
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600
+DEFAULT_WORKERS = 8
+TIMEOUT = 30
+DOCKER_HUB = "docker.io"
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+# key docker login uses for Docker Hub credentials
+DOCKER_HUB_AUTH = "https://index.docker.io/v1/"
+
+MANIFEST_TYPES = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
+)
+
+_challenge_re = re.compile(r'(\w+)="([^"]*)"')
+
+
+def is_pinned(image):
+    return "@" in image
+
+
+def image_reference(image):
+    """Split an image into (registry, repository, tag) the way docker does.
+
+    The first path component is only a registry when it looks like a host
+    name, otherwise the image lives on Docker Hub.
+    """
+    m = docker.parse_docker_tag(image)
+    if not m:
+        return None
+    parts = [p for p in (m["domain"], m["org"], m["image"]) if p]
+    domain = parts[0] if len(parts) > 1 else None
+    if domain and ("." in domain or ":" in domain or domain == "localhost"):
+        parts = parts[1:]
+    else:
+        domain = DOCKER_HUB
+        if len(parts) == 1:
+            parts.insert(0, "library")
+    return domain, "/".join(parts), m["version"] or "latest"
+
+
+class DigestCache:
+    """tag -> digest mappings persisted in a json file, each valid for ttl seconds."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if self.path and self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text(encoding="utf-8"))
+            except ValueError:
+                log.warning(f"Ignoring corrupt digest cache {self.path}")
+
+    def get(self, image):
+        with self._lock:
+            entry = self._entries.get(image)
+        if not entry or entry["expires"] < time.time():
+            return None
+        return entry["digest"]
+
+    def put(self, image, digest):
+        with self._lock:
+            self._entries[image] = dict(digest=digest, expires=time.time() + self.ttl)
+            self._dirty = True
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        with self._lock:
+            entries = {k: v for k, v in self._entries.items() if v["expires"] >= now}
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(entries, indent=2, sort_keys=True), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+class DigestResolver:
+    """Resolve image tags to content digests using the registry v2 API."""
+
+    def __init__(self, cache=None, max_workers=DEFAULT_WORKERS, docker_config=None):
+        self.cache = cache if cache is not None else DigestCache()
+        self.max_workers = max_workers
+        self.docker_config = docker_config or {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _base_url(self, domain):
+        if domain == DOCKER_HUB:
+            domain = DOCKER_HUB_REGISTRY
+        host = domain.rpartition(":")[0] or domain
+        # like docker, loopback registries are spoken to over plain http
+        if host == "localhost" or host.startswith("127."):
+            return f"http://{domain}"
+        return f"https://{domain}"
+
+    def _basic_auth(self, domain):
+        auths = self.docker_config.get("auths", {})
+        if domain == DOCKER_HUB and domain not in auths:
+            domain = DOCKER_HUB_AUTH
+        auth = auths.get(domain, {}).get("auth")
+        if auth:
+            return f"Basic {auth}"
+        return None
+
+    def _authorize(self, domain, response):
+        challenge = response.headers.get("WWW-Authenticate", "")
+        scheme, _, params = challenge.partition(" ")
+        basic = self._basic_auth(domain)
+        if scheme.lower() == "basic":
+            return basic
+        if scheme.lower() != "bearer":
+            return None
+        params = dict(_challenge_re.findall(params))
+        realm = params.pop("realm", None)
+        if not realm:
+            return None
+        headers = {"Authorization": basic} if basic else {}
+        r = self.session.get(realm, params=params, headers=headers, timeout=TIMEOUT)
+        r.raise_for_status()
+        data = r.json()
+        token = data.get("token") or data.get("access_token")
+        return f"Bearer {token}" if token else None
+
+    def lookup(self, image):
+        """Query the registry for the digest of image, bypassing the cache."""
+        ref = image_reference(image)
+        if not ref:
+            return None
+        domain, repository, tag = ref
+        url = f"{self._base_url(domain)}/v2/{repository}/manifests/{tag}"
+        headers = {"Accept": MANIFEST_TYPES}
+        r = self.session.head(url, headers=headers, timeout=TIMEOUT)
+        if r.status_code == requests.codes.unauthorized:
+            authorization = self._authorize(domain, r)
+            if authorization:
+                headers["Authorization"] = authorization
+                r = self.session.head(url, headers=headers, timeout=TIMEOUT)
+        if r.status_code != requests.codes.ok:
+            log.warning(f"Unable to resolve digest for {image}: HTTP {r.status_code}")
+            return None
+        return r.headers.get("Docker-Content-Digest")
+
+    def resolve(self, image):
+        if is_pinned(image):
+            return None
+        digest = self.cache.get(image)
+        if digest:
+            return digest
+        try:
+            digest = self.lookup(image)
+        except requests.RequestException as e:
+            log.warning(f"Unable to resolve digest for {image}: {e}")
+            return None
+        if digest:
+            self.cache.put(image, digest)
+        return digest
+
+    def resolve_many(self, images):
+        """Return {image: digest} for every image that could be resolved."""
+        images = sorted(set(filter(None, images)))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            digests = dict(zip(images, pool.map(self.resolve, images)))
+        self.cache.save()
+        return {k: v for k, v in digests.items() if v}
+
+
+def pin_images(graph, resolver):
+    """Replace the image of every service in graph with its tag@digest form.
+
+    Images which can't be resolved are left as they are.
+    """
+    services = [s for s in graph.services if s.get("image")]
+    digests = resolver.resolve_many([s.image for s in services])
+    for service in services:
+        digest = digests.get(service.image)
+        if digest:
+            service.add_facet({"image": f"{service.image}@{digest}"}, "<digests>")
+    return digests
+
+
+def resolver_for(config):
+    """Build a DigestResolver from the model config's cache settings."""
+    ttl = int(config.setting("cache.digest_ttl", DEFAULT_TTL))
+    cache = DigestCache(config.cache_dir / "digests.json", ttl=ttl)
+    return DigestResolver(cache=cache, docker_config=docker.parse_config())
@@ -1,15 +1,40 @@
+import functools
 import json
+import os
 import re
+import threading
 from pathlib import Path
 
+# Number of parsed image references kept
+TAG_CACHE_SIZE = 1024
+
+# path -> (mtime_ns, data)
+_configs = {}
+_configs_lock = threading.Lock()
+
 
 # Utils for managing ~/.docker/config.json
 def parse_config(cfg_name=None):
+    """Return the parsed docker config.
+
+    The result is cached until the file's mtime changes and is shared between
+    callers, so it must not be modified.
+    """
     if not cfg_name:
         cfg_name = Path("~/.docker/config.json").expanduser()
-    if not cfg_name.exists:
+    cfg_name = Path(cfg_name)
+    try:
+        mtime = os.stat(cfg_name).st_mtime_ns
+    except OSError:
         return None
-    data = json.load(cfg_name.open(mode="r"))
+    with _configs_lock:
+        cached = _configs.get(cfg_name)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with cfg_name.open(mode="r") as fp:
+        data = json.load(fp)
+    with _configs_lock:
+        _configs[cfg_name] = (mtime, data)
     return data
 
 
@@ -26,9 +51,17 @@ tag_re = re.compile(
 )
 
 
-def parse_docker_tag(tag):
+@functools.lru_cache(maxsize=TAG_CACHE_SIZE)
+def _parse_docker_tag(tag):
     m = tag_re.match(tag)
     if not m:
         return None
     return m.groupdict()
 
+
+def parse_docker_tag(tag):
+    m = _parse_docker_tag(tag)
+    if m is None:
+        return None
+    # callers own the result, the cached one stays pristine
+    return dict(m)
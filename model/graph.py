@@ -60,10 +60,10 @@ class Graph:
         # in the actual graph, but that can be ok for now
         return getattr(self.store, key)
 
-    def render(self, outputs=None):
+    def render(self, outputs=None, cache=None):
         if outputs is None:
             outputs = render.FileRenderer("-")
-        runtime_impl.render_graph(self, outputs)
+        runtime_impl.render_graph(self, outputs, cache=cache)
         outputs.write()
 
 
@@ -208,6 +208,6 @@ def plan(graph_entity, store, environment, runtime=None):
     return g
 
 
-def apply(graph, store, runtime, ren):
-    runtime_impl.render_graph(graph, ren)
+def apply(graph, store, runtime, ren, cache=None):
+    runtime_impl.render_graph(graph, ren, cache=cache)
     ren.write()
@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 
@@ -138,6 +139,9 @@ class Service(Featured, FeatureMixin):
     runtime: Runtime = field(default=None)
     # TODO: this can be in init and draw config from the graph
     config: Dict[str, Any] = field(default_factory=dict)
+    _relation_views: Dict[str, Any] = field(
+        init=False, default_factory=dict, repr=False, compare=False
+    )
 
     def __hash__(self):
         return hash((self.name, self.kind))
@@ -145,6 +149,11 @@ class Service(Featured, FeatureMixin):
     def fini(self):
         super().fini()
         self._populate_endpoint_config()
+        self.reset()
+
+    def reset(self):
+        """Drop state scoped to a single render."""
+        self._relation_views.clear()
 
     def _populate_endpoint_config(self):
         env_config = self.graph.environment.get("config", {})
@@ -260,7 +269,16 @@ class Service(Featured, FeatureMixin):
             config=self.full_config(),
         )
 
-    def full_relation(self, relation, secrets=False):
+    def materialize_relation(self, relation):
+        """Return the (public, secret) data provided to this service by relation.
+
+        Both views are built from a single pass over the remote endpoint's
+        provides and interpolated together. The result is cached per relation
+        for the current render, callers get a copy of it.
+        """
+        views = self._relation_views.get(relation.name)
+        if views is not None:
+            return copy.deepcopy(views)
         remote = relation.get_remote(self)
         local = relation.get_local(self)
         context = dict(
@@ -272,15 +290,23 @@ class Service(Featured, FeatureMixin):
             graph=self.graph,
             runtime=self.runtime,
         )
-        if secrets:
-            base = remote.provided_secrets
-        else:
-            base = remote.provided
-        base["interface"] = local.interface.qual_name
-        base["service_name"] = remote.service.name
-        data = {local.name: base}
+        data = {}
+        for view, base in zip(
+            ("public", "secret"), remote.partition_values(remote.provides)
+        ):
+            base["interface"] = local.interface.qual_name
+            base["service_name"] = remote.service.name
+            data[view] = {local.name: base}
 
-        return utils.interpolate(data, context)
+        data = utils.interpolate(data, context)
+        views = self._relation_views[relation.name] = (data["public"], data["secret"])
+        return copy.deepcopy(views)
+
+    def full_relation(self, relation, secrets=False):
+        public, secret = self.materialize_relation(relation)
+        if secrets:
+            return secret
+        return public
 
     def full_relations(self, secrets=False):
         rels = {}
@@ -400,9 +426,8 @@ class Interface(GraphObj):
         rel = service.get_relation_by_endpoint(endpoint)
         ep = rel.get_remote(service)
         rservice = ep.service
-        vals = rservice.full_relation(rel)
-        priv = rservice.full_relation(rel, secrets=True)
-        vals = jsonmerge.merge(vals, priv)
+        public, secret = rservice.materialize_relation(rel)
+        vals = {endpoint.name: dict(public[endpoint.name], **secret[endpoint.name])}
         specs = utils.pick(self.roles, name=endpoint.role).get("provides", [])
         type_map = {"str": str, "string": str, "int": int, "number": (int, float)}
         for spec in specs:
@@ -441,18 +466,24 @@ class Endpoint:
             c = {}
         return c
 
-    def normalize_values(self, data, secrets=False):
+    def partition_values(self, data):
         # take the schema styled config data and map it to kvpairs
-        result = utils.AttrAccess()
+        # split into (public, secret) views in a single pass
+        public = utils.AttrAccess()
+        secret = utils.AttrAccess()
         for spec in data:
             name = spec["name"]
-            is_secret = spec.get("secret", False)
-            if (is_secret and secrets is False) or (not is_secret and secrets is True):
-                # XXX: we could put "<redacted>"
-                # but for now we omit those  fields
-                continue
+            result = secret if spec.get("secret", False) else public
             result[name] = self.data.get(name, spec.get("default"))
-        return result
+        return public, secret
+
+    def normalize_values(self, data, secrets=False):
+        # XXX: we could put "<redacted>" in place of the other view's fields
+        # but for now we omit those fields
+        public, secret = self.partition_values(data)
+        if secrets:
+            return secret
+        return public
 
     @property
     def provides(self):
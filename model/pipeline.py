@@ -1,12 +1,15 @@
+import copy
 import io
 import json
 import logging
 import re
 import subprocess
 import tempfile
+import threading
 import time
-
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass, field
+from pathlib import Path
 from typing import Any, Dict, List
 
 import yaml
@@ -15,24 +18,190 @@ from . import config
 from . import entity
 from . import exceptions
 from . import model
+from . import process
 from . import schema
 from . import utils
 
 log = logging.getLogger(__name__)
 segments_map = {}
 
+# Pipeline failure policies
+FAIL_FAST = "fail-fast"
+CONTINUE = "continue"
+DEFAULT_WORKERS = 4
+# Segment states satisfying the segments depending on them
+COMPLETED = ("done", "unchanged", "resumed")
+# Characters of each segment's output kept in the checkpoint
+MAX_CHECKPOINT_OUTPUT = 64 * 1024
+
 
 def register_class(cls):
     segments_map[cls.__name__.lower()] = cls
     return cls
 
 
+class PipelineState:
+    """What previous runs of a pipeline in an environment did, kept as json."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self.data = json.loads(self.path.read_text(encoding="utf-8"))
+            except ValueError:
+                log.warning(f"Ignoring corrupt pipeline state {self.path}")
+
+    @classmethod
+    def for_pipeline(cls, directory, pipeline, environment):
+        env = getattr(environment, "name", None) or "default"
+        name = f"{env}-{pipeline.name}".replace("/", "_")
+        return cls(Path(directory) / "pipelines" / f"{name}.json")
+
+    def fingerprint(self, segment):
+        return self.data.get("fingerprints", {}).get(segment)
+
+    def record(self, segment, fingerprint):
+        with self._lock:
+            self.data.setdefault("fingerprints", {})[segment] = fingerprint
+            self._save()
+
+    def start_checkpoint(self):
+        with self._lock:
+            self.data["checkpoint"] = dict(started=time.time(), segments={})
+            self._save()
+
+    def checkpointed(self):
+        """Map of the segments completed since the checkpoint was started"""
+        return self.data.get("checkpoint", {}).get("segments", {})
+
+    def complete(self, segment, status, output=None):
+        if output and len(output) > MAX_CHECKPOINT_OUTPUT:
+            output = output[-MAX_CHECKPOINT_OUTPUT:]
+        with self._lock:
+            checkpoint = self.data.setdefault("checkpoint", dict(segments={}))
+            checkpoint["segments"][segment] = dict(
+                status=status, finished=time.time(), output=output
+            )
+            self._save()
+
+    def clear_checkpoint(self):
+        with self._lock:
+            if self.data.pop("checkpoint", None) is not None:
+                self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        data = json.dumps(self.data, indent=2, sort_keys=True)
+        tmp.write_text(data, encoding="utf-8")
+        tmp.replace(self.path)
+
+
+class ClusterState:
+    """Snapshot of the cluster objects read during a pipeline run.
+
+    The objects of a resource type in a namespace are listed with a single
+    kubectl call when the first of them is read, later reads are answered
+    from memory and the writes of the run update (or drop) the snapshot.
+    """
+
+    def __init__(self):
+        # (namespace, resource type) -> {name: object}
+        self._lists = {}
+        # (namespace, resource type) that can't be listed (e.g. RBAC only
+        # allowing get), their objects are read one by one
+        self._unlisted = set()
+        # bumped by invalidate, a list read while it changed isn't kept
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, segment, resource, namespace="default"):
+        """The object for resource (type/name) or None, listing its type with
+        segment when it isn't known yet."""
+        kind, _, name = resource.partition("/")
+        key = (namespace, kind)
+        with self._lock:
+            objects = self._lists.get(key)
+            generation = self._generation
+            unlisted = key in self._unlisted
+        if unlisted:
+            return self._read(segment, resource, namespace)
+        if objects is None:
+            # kubectl runs unlocked, concurrent reads of other types or
+            # namespaces don't wait on it
+            result = segment._run(
+                cmd=f"kubectl get -n {namespace} -o json {kind}",
+                output_level=logging.DEBUG,
+                allow_failure=True,
+                record_output=False,
+            )
+            if result is False:
+                return None
+            if result.returncode != 0:
+                log.debug(f"unable to list {kind} in {namespace}, reading {name}")
+                with self._lock:
+                    self._unlisted.add(key)
+                return self._read(segment, resource, namespace)
+            items = json.loads(result.stdout).get("items") or []
+            objects = {i["metadata"]["name"]: i for i in items}
+            with self._lock:
+                if generation == self._generation:
+                    objects = self._lists.setdefault(key, objects)
+        with self._lock:
+            found = objects.get(name)
+            return copy.deepcopy(found)
+
+    def refresh(self, segment, resource, namespace="default"):
+        """Read resource (type/name) from the cluster again, updating the
+        snapshot. Returns None when it can't be read."""
+        obj = self._read(segment, resource, namespace)
+        if obj is not None:
+            self.put(resource, obj, namespace)
+        return obj
+
+    def _read(self, segment, resource, namespace):
+        result = segment._run(
+            cmd=f"kubectl get -n {namespace} -o json {resource}",
+            output_level=logging.DEBUG,
+            record_output=False,
+        )
+        if result is False:
+            return None
+        return json.loads(result.stdout)
+
+    def put(self, resource, obj, namespace="default"):
+        kind, _, name = resource.partition("/")
+        with self._lock:
+            objects = self._lists.get((namespace, kind))
+            if objects is not None:
+                objects[name] = copy.deepcopy(obj)
+
+    def invalidate(self, namespace=None):
+        """Forget the objects of namespace (all of them by default), e.g.
+        after applying a manifest"""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._lists if namespace in (None, k[0])]:
+                del self._lists[key]
+
+
+def _serialized(obj):
+    ent = getattr(obj, "entity", None)
+    if ent is not None:
+        return ent.serialized()
+    return getattr(obj, "config", None)
+
+
 @dataclass
 class Segment(model.GraphObj):
     """When Pipeline Segments run they are expected to enforce loosely idempotent state changes
     such that more than one invocation should only progress towards the expected state."""
 
     pipeline: "Pipeline"
+    # output of the last run, restored from the checkpoint when resuming
+    output: str = field(init=False, default=None, repr=False, compare=False)
 
     def dispatch(self):
         "return the correct method/action to run for a given step"
@@ -44,6 +213,47 @@ class Segment(model.GraphObj):
             )
         return method
 
+    @property
+    def writes_cluster(self):
+        """Whether running the segment can change cluster objects, the run's
+        ClusterState is dropped after such segments. Segments keeping it up
+        to date themselves return False."""
+        return bool(self.get("writes_cluster", True))
+
+    @property
+    def depends_on(self):
+        deps = self.get("depends_on") or []
+        if isinstance(deps, str):
+            deps = [deps]
+        return list(deps)
+
+    def fingerprint(self, store, environment):
+        """Hash of everything the segment's action depends on or None when the
+        segment has to run every time."""
+        if self.get("always_run"):
+            return None
+        pipeline = self.pipeline.entity.serialized()
+        pipeline.pop("segments", None)
+        inputs = dict(
+            kind=self.kind,
+            segment=self.entity.serialized(),
+            # pipeline level settings and the (interpolated) environment
+            # can change what a segment does without the segment changing
+            pipeline=pipeline,
+            environment=_serialized(environment),
+            inputs=self._inputs(store, environment),
+        )
+        try:
+            return utils.fingerprint(inputs)
+        except (TypeError, ValueError) as e:
+            # an unstable fingerprint would rerun it (or skip it) at random
+            log.warning(f"segment {self.name} always runs, no fingerprint: {e}")
+            return None
+
+    def _inputs(self, store, environment):
+        "resolved inputs of the action beyond the segment's own (interpolated) data"
+        return None
+
     def run(self, store, environment):
         print(f"Running {self.name}:{self.kind}")
 
@@ -62,18 +272,33 @@ class Segment(model.GraphObj):
 @dataclass
 class Script(Segment):
     """Run a script doing any needed interpolation on the command
+
+    Command output is logged line by line as it is produced. With
+    `parallel: true` the commands of the script run concurrently.
     """
 
     DEFAULT_TIMEOUT = 60
+    DEFAULT_CONCURRENCY = 4
+    OUTPUT_LEVEL = logging.INFO
 
     def run(self, store, environment):
         context = self._context(store, environment)
         cmds = self.get("commands")
         if not cmds:
             cmds = [self.command]
-        for c in cmds:
-            cmd = self._prepare(c, context)
-            result = self._run(cmd, context)
+        cmds = [self._prepare(c, context) for c in cmds]
+        if self.get("parallel"):
+            results = self._run_many(cmds, context)
+        else:
+            results = []
+            for cmd in cmds:
+                results.append(self._run(cmd, context))
+        return all(result is not False for result in results)
+
+    def _inputs(self, store, environment):
+        context = self._context(store, environment)
+        cmds = self.get("commands") or [self.get("command")]
+        return [self._prepare(c, context) for c in cmds if c]
 
     def _prepare(self, cmd, context):
         if isinstance(cmd, list):
@@ -81,83 +306,204 @@ class Script(Segment):
         cmd = utils.interpolate(cmd, context)
         return cmd
 
-    def _run(self, cmd, context=None, **kwargs):
-        timeout = self.get("timeout", self.DEFAULT_TIMEOUT)
-        if "timeout" not in kwargs:
-            kwargs["timeout"] = timeout
-        timeout = kwargs.pop("timeout")
-        input = kwargs.pop("input", None)
-        allow_failure = kwargs.pop("allow_failure", False)
+    def _output_logger(self, level):
+        def on_line(line):
+            log.log(level, f"{self.name}: {line}")
+
+        return on_line
+
+    def _command(self, kwargs):
+        """Split _run keyword arguments into process.run ones and the
+        allow_failure and record_output options"""
+        kwargs = dict(kwargs)
+        kwargs.setdefault("timeout", self.get("timeout", self.DEFAULT_TIMEOUT))
+        options = dict(
+            allow_failure=kwargs.pop("allow_failure", False),
+            # reads of cluster state aren't the segment's output (and may
+            # hold secrets), they stay out of the checkpoint
+            record_output=kwargs.pop("record_output", True),
+        )
+        on_line = self._output_logger(kwargs.pop("output_level", self.OUTPUT_LEVEL))
+        kwargs["on_stdout"] = kwargs["on_stderr"] = on_line
+        return kwargs, options
 
-        try:
-            log.debug(f"Run '{cmd}' with {kwargs}\n{input}")
-            with subprocess.Popen(
+    def _trace(self, cmd, result, started):
+        tracer = self.pipeline.tracer
+        if tracer is None:
+            return
+        if isinstance(result, Exception):
+            tracer.record(
+                "command",
                 cmd,
-                shell=not isinstance(cmd, (list, tuple)),
-                encoding="utf-8",
-                text=True,
-                stdin=subprocess.PIPE if input else subprocess.DEVNULL,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                **kwargs,
-            ) as proc:
-                out, err = proc.communicate(input, timeout=timeout)
-
-                if proc.returncode != 0 and not allow_failure:
-                    raise subprocess.CalledProcessError(
-                        proc.returncode, cmd, output=out, stderr=err
-                    )
-        except subprocess.TimeoutExpired as e:
-            log.exception(f"{self.name}: {cmd} expired with timeout.\n{out}\n{err}")
-        except (subprocess.CalledProcessError, OSError, Exception) as e:
-            log.exception(f"{self.name}: {cmd} resulted in error")
-            log.warning(f"{out}\n{err}")
+                started,
+                segment=self.name,
+                status=type(result).__name__,
+                exit_code=None,
+                output_bytes=None,
+            )
+            return
+        tracer.record(
+            "command",
+            cmd,
+            result.started,
+            result.finished,
+            segment=self.name,
+            status="ok" if result.returncode == 0 else "error",
+            exit_code=result.returncode,
+            output_bytes=result.output_bytes,
+        )
+
+    def _check(self, cmd, result, allow_failure, started=None, record_output=True):
+        self._trace(cmd, result, started or time.time())
+        if isinstance(result, subprocess.TimeoutExpired):
+            log.error(f"{self.name}: {cmd} expired with timeout.")
+        elif isinstance(result, Exception):
+            log.error(f"{self.name}: {cmd} resulted in error: {result}")
+        elif result.returncode != 0 and not allow_failure:
+            log.error(f"{self.name}: {cmd} exited with {result.returncode}")
         else:
-            log.debug(f"{self.name}: SUCCESS {cmd}\n{out}\n{err}")
-            proc.stdout = out
-            proc.stderr = err
-            return proc
+            log.debug(f"{self.name}: SUCCESS {cmd}")
+            if record_output:
+                # the last command's output is the segment's
+                self.output = result.stdout
+            return result
         return False
 
+    def _run(self, cmd, context=None, **kwargs):
+        kwargs, options = self._command(kwargs)
+        log.debug(f"Run '{cmd}'\n{kwargs.get('input') or ''}")
+        started = time.time()
+        try:
+            result = process.run(cmd, **kwargs)
+        except Exception as e:
+            result = e
+        return self._check(cmd, result, started=started, **options)
+
+    def _run_many(self, cmds, context=None, **kwargs):
+        """Run cmds concurrently, returning a _run style result for each"""
+        kwargs, options = self._command(kwargs)
+        concurrency = int(self.get("max_concurrency", self.DEFAULT_CONCURRENCY))
+        started = time.time()
+        results = process.run_many(
+            [(cmd, kwargs) for cmd in cmds], max_concurrency=concurrency
+        )
+        return [
+            self._check(c, r, started=started, **options) for c, r in zip(cmds, results)
+        ]
+
 
 @register_class
 @dataclass
 class KubernetesManifest(Script):
     """Apply a kubernetes manifest
     The manifest is first subject to interpolation using the model and jinja2 templating.
+
+    The documents of the manifest are passed to kubectl in batches of
+    `batch_size` (all of them by default, 1 runs kubectl per document).
     """
 
+    # actions reporting what they did with -o name, used to tell which
+    # documents of a batch failed
+    NAMED_ACTIONS = {"apply", "create", "replace", "delete"}
+    # attempts at replacing a patched object changed by someone else meanwhile
+    PATCH_RETRIES = 3
+    CONFLICT_ERRORS = ("the object has been modified", "Conflict")
+
+    @property
+    def writes_cluster(self):
+        # run and patch update the ClusterState with what they change
+        return False
+
     def run(self, store, environment):
         template = environment.get_template(self.template)
         context = self._context(store, environment)
         rendered = template.render(context)
         action = self.command or "apply"
         # Look at the rendered content, it might be multi-part yaml (via ---)
-        # if it is we must apply each object in turn
-        yamlobjs = yaml.safe_load_all(rendered)
-        for yamlobj in yamlobjs:
-            yamlobj = yaml.safe_dump(yamlobj)
-            self._run(cmd=f"kubectl {action} -f -", context=context, input=yamlobj)
-        return True
+        docs = [d for d in yaml.safe_load_all(rendered) if d]
+        size = int(self.get("batch_size", 0)) or len(docs)
+        ok = True
+        for i in range(0, len(docs), size or 1):
+            batch = docs[i : i + size]
+            # the rendered manifest can be passed as is when it is one batch
+            input = rendered if len(batch) == len(docs) else yaml.safe_dump_all(batch)
+            ok = self._apply_batch(action, batch, input, context) and ok
+        cluster = self.pipeline.cluster
+        if cluster is not None:
+            namespaces = {(d.get("metadata") or {}).get("namespace") for d in docs}
+            for namespace in namespaces:
+                cluster.invalidate(namespace or "default")
+        return ok
+
+    def _inputs(self, store, environment):
+        template = environment.get_template(self.template)
+        return template.render(self._context(store, environment))
+
+    def _doc_name(self, doc):
+        md = doc.get("metadata") or {}
+        return f"{doc.get('kind', '').lower()}/{md.get('name')}"
+
+    def _apply_batch(self, action, docs, input, context):
+        named = action in self.NAMED_ACTIONS
+        cmd = f"kubectl {action} -f -"
+        if named:
+            cmd += " -o name"
+        result = self._run(cmd, context=context, input=input, allow_failure=True)
+        if result is False:
+            return False
+        if result.returncode == 0:
+            return True
+        if not named:
+            log.error(f"{self.name}: {cmd} exited with {result.returncode}")
+            return False
+
+        # -o name reports kind[.group]/name for each document handled
+        done = set()
+        for line in result.stdout.splitlines():
+            kind, _, name = line.strip().partition("/")
+            done.add(f"{kind.partition('.')[0]}/{name}")
+        errors = result.stderr.splitlines()
+        for doc in docs:
+            name = self._doc_name(doc)
+            if name in done:
+                continue
+            short = name.partition("/")[2]
+            reasons = [e for e in errors if short and f'"{short}"' in e] or errors
+            log.error(f"{self.name}: {action} {name} failed: {' '.join(reasons)}")
+        return False
 
     def get_resource(self, resource, namespace="default", strip=False):
-        result = self._run(
-            cmd=f"kubectl get -n {namespace} -o json {resource}", context=None
-        )
-        resource = json.loads(result.stdout)
-        if strip:
-            md = resource["metadata"]
-            dels = set(md.keys()) - {"name", "namespace", "labels", "annotations"}
-            for k in dels:
-                del md[k]
+        """Read resource (type/name), from the run's ClusterState when there
+        is one. Returns None when it can't be read."""
+        cluster = self.pipeline.cluster
+        if cluster is not None and "/" in resource:
+            resource = cluster.get(self, resource, namespace)
+        else:
+            result = self._run(
+                cmd=f"kubectl get -n {namespace} -o json {resource}",
+                context=None,
+                output_level=logging.DEBUG,
+                record_output=False,
+            )
+            resource = json.loads(result.stdout) if result else None
+        if resource is not None and strip:
+            self._strip(resource)
         return resource
 
+    def _strip(self, resource):
+        md = resource["metadata"]
+        # resourceVersion is kept so a replace of the object fails when it
+        # changed since it was read
+        keep = {"name", "namespace", "labels", "annotations", "resourceVersion"}
+        for k in set(md.keys()) - keep:
+            del md[k]
+
     def patch(self, store, environment):
         # Strategy is
         # - read the object
         # - read the template
         # - do a full object patch (jsonmerge)
-        # - replace the object
+        # - replace the object, reading it again when it changed meanwhile
         resource = self.get_resource(
             self.resource, namespace=self.namespace, strip=True
         )
@@ -165,22 +511,73 @@ class KubernetesManifest(Script):
         context = self._context(store, environment)
         rendered = template.render(context)
         rendered = yaml.safe_load(rendered)
-        output = utils.apply_overrides(resource, rendered["config"])
-        output = yaml.dump(output)
-        log.debug(output)
-        self._run(
-            cmd=f"kubectl replace -n {self.namespace} {self.resource} -f -",
-            context=context,
-            input=output,
-        )
+        cmd = f"kubectl replace -n {self.namespace} -f - -o json"
+        for attempt in range(self.PATCH_RETRIES):
+            if resource is None:
+                log.error(f"{self.name}: unable to read {self.resource} to patch")
+                return False
+            overrides = copy.deepcopy(rendered["config"])
+            output = yaml.dump(utils.apply_overrides(resource, overrides))
+            log.debug(output)
+            result = self._run(
+                cmd=cmd,
+                context=context,
+                input=output,
+                output_level=logging.DEBUG,
+                allow_failure=True,
+                record_output=False,
+            )
+            if result is False:
+                return False
+            if result.returncode == 0:
+                break
+            if not any(e in result.stderr for e in self.CONFLICT_ERRORS):
+                log.error(f"{self.name}: {cmd} exited with {result.returncode}")
+                return False
+            log.info(f"{self.name}: {self.resource} changed, reading it again")
+            resource = self._refresh(self.resource, self.namespace)
+        else:
+            log.error(f"{self.name}: {self.resource} kept changing, not patched")
+            return False
+        if self.pipeline.cluster is not None:
+            replaced = json.loads(result.stdout)
+            self.pipeline.cluster.put(self.resource, replaced, self.namespace)
+        return True
+
+    def _refresh(self, resource, namespace):
+        cluster = self.pipeline.cluster
+        if cluster is None:
+            return self.get_resource(resource, namespace=namespace, strip=True)
+        resource = cluster.refresh(self, resource, namespace)
+        if resource is not None:
+            self._strip(resource)
+        return resource
 
 
 _nodegroup_re = re.compile(r"(?P<name>[-\w]+)(-(?P<num>\d+))")
+# label eksctl puts on the nodes of each nodegroup
+NODEGROUP_LABEL = "alpha.eksctl.io/nodegroup-name"
+NODEGROUP_TIMEOUT = 20 * 60
 
 
 @register_class
 @dataclass
 class Eksctl(Script):
+    DEFAULT_PARALLEL = 4
+    DEFAULT_POLL_INTERVAL = 30
+
+    def fingerprint(self, store, environment):
+        # every replacement rolls the nodegroups again
+        if self.get("action") == "replace_nodegroups":
+            return None
+        return super().fingerprint(store, environment)
+
+    def _inputs(self, store, environment):
+        if self.get("action") == "provision":
+            return Path(self.config).read_text(encoding="utf-8")
+        context = self._context(store, environment)
+        return self._prepare(f"eksctl {self.get('command')}", context)
+
     # provisioning can take a long time, this would create a blocking wait
     # for creates
     def run(self, store, environment):
@@ -193,7 +590,11 @@ class Eksctl(Script):
         # see if the cluster exists, log and continue
         config = utils.AttrAccess(yaml.safe_load(open(self.config)))
         cluster_name = config["metadata"]["name"]
-        result = self._run(f"eksctl get cluster {cluster_name}", allow_failure=True)
+        result = self._run(
+            f"eksctl get cluster {cluster_name}",
+            allow_failure=True,
+            record_output=False,
+        )
         if result.returncode == 0:
             # this indicates we already have a cluster of this name
             log.info(f"EKS cluster {cluster_name} already exists.")
@@ -285,23 +686,82 @@ class Eksctl(Script):
         log.info(
             "Creating and draining nodegroups can take a substantial amount of time, 20m default timeout"
         )
-        # XXX: run loop in parallel??
+        return self._roll_nodegroups(config, namemap)
+
+    def _nodes_ready(self, nodegroup):
+        result = self._run(
+            f"kubectl get nodes -l {NODEGROUP_LABEL}={nodegroup} -o json",
+            output_level=logging.DEBUG,
+            record_output=False,
+        )
+        if result is False:
+            return 0
+        ready = 0
+        for node in json.loads(result.stdout).get("items", []):
+            conditions = node.get("status", {}).get("conditions", [])
+            if utils.pick(conditions, type="Ready", status="True"):
+                ready += 1
+        return ready
+
+    def _wait_ready(self, nodegroup, expected):
+        timeout = int(self.get("ready_timeout", NODEGROUP_TIMEOUT))
+        interval = float(self.get("poll_interval", self.DEFAULT_POLL_INTERVAL))
+        deadline = time.monotonic() + timeout
+        while True:
+            ready = self._nodes_ready(nodegroup)
+            log.info(f"nodegroup {nodegroup}: {ready}/{expected} nodes ready")
+            if ready >= expected:
+                return True
+            if time.monotonic() > deadline:
+                log.error(f"nodegroup {nodegroup} not ready after {timeout}s")
+                return False
+            time.sleep(interval)
+
+    def _replace_nodegroup(self, config, old, new):
         cn = config["metadata"]["name"]
-        for old, new in namemap.items():
-            # create the new group
-            log.info(f"creating new node group {new}")
-            self._run(
-                f"eksctl create nodegroup --config-file - --include='{new}'",
-                input=config,
-            )
-            # XXX: We almost certainly want a wait-nodes loop here
-            # delete the old group
-            # this will do the drain as well
-            log.info(f"deleting old nodegroup {old}")
+        ng = utils.pick(config["nodeGroups"], name=new, default={})
+        expected = ng.get("desiredCapacity", ng.get("minSize", 1))
+        # create the new group
+        log.info(f"creating new node group {new}")
+        created = self._run(
+            f"eksctl create nodegroup --config-file - --include='{new}'",
+            input=yaml.safe_dump(config),
+            timeout=NODEGROUP_TIMEOUT,
+        )
+        if created is False or not self._wait_ready(new, expected):
+            log.error(f"keeping nodegroup {old} as {new} didn't become ready")
+            return False
+        # delete the old group
+        # this will do the drain as well
+        log.info(f"deleting old nodegroup {old}")
+        return (
             self._run(
                 f"eksctl delete nodegroup -w --approve --cluster={cn} {old}",
-                timeout=(20 * 60),
+                timeout=NODEGROUP_TIMEOUT,
             )
+            is not False
+        )
+
+    def _roll_nodegroups(self, config, namemap):
+        """Replace old nodegroups with new ones, max_parallel of them at a time."""
+        config = dict(config)
+        workers = int(self.get("max_parallel", self.DEFAULT_PARALLEL)) or len(namemap)
+        total = len(namemap)
+        done = 0
+        ok = True
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = {
+                pool.submit(self._replace_nodegroup, config, old, new): old
+                for old, new in namemap.items()
+            }
+            for future in as_completed(futures):
+                old = futures[future]
+                done += 1
+                replaced = future.result()
+                ok = ok and replaced
+                state = "replaced" if replaced else "FAILED"
+                log.info(f"nodegroup {old} {state} ({done}/{total})")
+        return ok
 
 
 @schema.register_class
@@ -309,6 +769,10 @@ class Eksctl(Script):
 class Pipeline(model.GraphObj):
     kind: str = field(init=False, default="Pipeline")
     segments: List[Segment]
+    # trace.Tracer recording the current run
+    tracer: Any = field(init=False, default=None, repr=False, compare=False)
+    # ClusterState of the current run
+    cluster: Any = field(init=False, default=None, repr=False, compare=False)
 
     def __hash__(self):
         return hash(self.name)
@@ -341,13 +805,188 @@ class Pipeline(model.GraphObj):
             ctx = segment._context(cfg.store, cfg.environment)
             segment._interpolate_entity(ctx)
 
-    def run(self, store, environment, segments=None):
-        for segment in self.segments:
-            if segments and segment.name not in segments:
+    def _dependencies(self, selected):
+        """Map each selected segment name to the selected segments it waits on.
+
+        When no segment declares depends_on the segments run in the order
+        they are listed.
+        """
+        known = [s.name for s in self.segments]
+        if len(set(known)) != len(known):
+            raise exceptions.ConfigurationError(
+                f"pipeline {self.name} has duplicate segment names"
+            )
+        names = {s.name for s in selected}
+        explicit = any(s.get("depends_on") is not None for s in self.segments)
+        deps = {}
+        previous = None
+        for segment in selected:
+            if explicit:
+                unknown = set(segment.depends_on) - set(known)
+                if unknown:
+                    raise exceptions.ConfigurationError(
+                        f"segment {segment.name} depends on unknown segments "
+                        f"{sorted(unknown)}"
+                    )
+                # dependencies not selected for this run are taken as satisfied
+                deps[segment.name] = [d for d in segment.depends_on if d in names]
+            else:
+                deps[segment.name] = [previous] if previous else []
+            previous = segment.name
+        self._check_acyclic(deps)
+        return deps
+
+    def _check_acyclic(self, deps):
+        remaining = {k: set(v) for k, v in deps.items()}
+        while remaining:
+            ready = [k for k, v in remaining.items() if not v]
+            if not ready:
+                raise exceptions.ConfigurationError(
+                    f"pipeline {self.name} has a dependency cycle between "
+                    f"{sorted(remaining)}"
+                )
+            for k in ready:
+                del remaining[k]
+            for v in remaining.values():
+                v.difference_update(ready)
+
+    def _run_segment(self, segment, store, environment, state=None, force=False):
+        started = time.time()
+        try:
+            result = self._execute_segment(segment, store, environment, state, force)
+        except Exception:
+            log.exception(f"segment {segment.name} raised an error")
+            result = "failed"
+        if self.tracer is not None:
+            self.tracer.record(
+                "segment", segment.name, started, kind=segment.kind, status=result
+            )
+        return result
+
+    def _execute_segment(self, segment, store, environment, state, force):
+        fingerprint = None
+        if state is not None:
+            fingerprint = segment.fingerprint(store, environment)
+            if (
+                not force
+                and fingerprint is not None
+                and state.fingerprint(segment.name) == fingerprint
+            ):
+                log.info(f"segment {segment.name} is unchanged since its last run")
+                return "unchanged"
+        # Adapt the calling convention to each type of segment
+        # this means its either
+        #    a plugin (getting passed the graph objects)
+        #    a script (mapping args via interpolation)
+        action = segment.dispatch()
+        log.info(f"running segment {segment.name}")
+        segment.output = None
+        try:
+            ok = action(store, environment) is not False
+        finally:
+            if segment.writes_cluster and self.cluster is not None:
+                # the segment may have changed any object, later reads list
+                # them again
+                self.cluster.invalidate()
+        if not ok:
+            return "failed"
+        if fingerprint is not None:
+            state.record(segment.name, fingerprint)
+        return "done"
+
+    def _resumed(self, selected, state):
+        status = {}
+        for segment in selected:
+            entry = state.checkpointed().get(segment.name)
+            if not entry:
                 continue
-            # Adapt the calling convention to each type of segment
-            # this means its either
-            #    a plugin (getting passed the graph objects)
-            #    a script (mapping args via interpolation)
-            action = segment.dispatch()
-            action(store, environment)
+            log.info(f"segment {segment.name} already completed, resuming after it")
+            segment.output = entry.get("output")
+            status[segment.name] = "resumed"
+        return status
+
+    def run(
+        self,
+        store,
+        environment,
+        segments=None,
+        max_workers=None,
+        on_failure=None,
+        state=None,
+        force=False,
+        resume=False,
+        tracer=None,
+    ):
+        """Run the (selected) segments, each as soon as the segments it depends on
+        have completed, with at most max_workers running at once.
+
+        On failure the fail-fast policy stops starting new segments while
+        continue only skips the segments depending on the failed one. When a
+        PipelineState is given segments whose fingerprint matches their last
+        successful run are not run again unless forced, and the completed
+        segments are checkpointed so a failed run can be resumed. Returns a
+        map of segment name to "done", "unchanged", "resumed", "failed" or
+        "skipped". The segments and commands run are timed with tracer.
+        """
+        self.tracer = tracer
+        self.cluster = ClusterState()
+        selected = [s for s in self.segments if not segments or s.name in segments]
+        deps = self._dependencies(selected)
+        max_workers = int(max_workers or self.get("max_workers", DEFAULT_WORKERS))
+        on_failure = on_failure or self.get("on_failure", FAIL_FAST)
+        if on_failure not in (FAIL_FAST, CONTINUE):
+            raise exceptions.ConfigurationError(
+                f"unknown on_failure policy {on_failure} for pipeline {self.name}"
+            )
+
+        status = {}
+        if state is not None:
+            if resume:
+                status = self._resumed(selected, state)
+            else:
+                state.start_checkpoint()
+        pending = [s for s in selected if s.name not in status]
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                stopping = on_failure == FAIL_FAST and "failed" in status.values()
+                for segment in list(pending):
+                    wanted = [status.get(d) for d in deps[segment.name]]
+                    ready = all(w in COMPLETED for w in wanted)
+                    if stopping or any(w in ("failed", "skipped") for w in wanted):
+                        log.warning(f"skipping segment {segment.name}")
+                        status[segment.name] = "skipped"
+                        pending.remove(segment)
+                    elif ready and len(running) < max_workers:
+                        future = pool.submit(
+                            self._run_segment,
+                            segment,
+                            store,
+                            environment,
+                            state=state,
+                            force=force,
+                        )
+                        running[future] = segment
+                        pending.remove(segment)
+                if not running:
+                    continue
+                try:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                except KeyboardInterrupt:
+                    process.terminate_all()
+                    raise
+                for future in finished:
+                    segment = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        log.exception(f"segment {segment.name} raised an error")
+                        result = "failed"
+                    status[segment.name] = result
+                    if result == "failed":
+                        log.error(f"segment {segment.name} failed")
+                    elif state is not None:
+                        state.complete(segment.name, result, segment.output)
+        if state is not None and all(v in COMPLETED for v in status.values()):
+            state.clear_checkpoint()
+        return status
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import time
+from dataclasses import dataclass, field
+
+log = logging.getLogger(__name__)
+
+# Bytes read from a pipe at once
+CHUNK_SIZE = 64 * 1024
+# Output kept in memory per stream, beyond this only the tail is kept
+MAX_CAPTURE = 8 * 1024 * 1024
+# Time a process gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE = 5
+
+# pids of the running processes, each leading its own process group
+_live = set()
+
+
+@dataclass
+class Result:
+    cmd: str
+    returncode: int = None
+    stdout: str = ""
+    stderr: str = ""
+    started: float = None
+    finished: float = None
+    output_bytes: int = 0
+    truncated: bool = False
+
+    @property
+    def duration(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+
+@dataclass
+class _Capture:
+    limit: int
+    chunks: list = field(default_factory=list)
+    size: int = 0
+    total: int = 0
+    truncated: bool = False
+
+    def add(self, data):
+        self.total += len(data)
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size > self.limit and len(self.chunks) > 1:
+            self.size -= len(self.chunks.pop(0))
+            self.truncated = True
+
+    def text(self):
+        return b"".join(self.chunks).decode("utf-8", errors="replace")
+
+
+async def _pump(stream, capture, on_line):
+    partial = b""
+    while True:
+        data = await stream.read(CHUNK_SIZE)
+        if not data:
+            break
+        capture.add(data)
+        if on_line is None:
+            continue
+        lines = (partial + data).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            on_line(line.decode("utf-8", errors="replace"))
+        if len(partial) > CHUNK_SIZE:
+            # don't let a single huge line grow without bound
+            on_line(partial.decode("utf-8", errors="replace"))
+            partial = b""
+    if partial and on_line is not None:
+        on_line(partial.decode("utf-8", errors="replace"))
+
+
+def _signal(proc, sig):
+    try:
+        # the process leads its own group, reach any children (shells) too
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def terminate_all():
+    """Terminate every running process, used when the caller is interrupted
+    as they don't share our process group (and so its SIGINT)."""
+    for pid in list(_live):
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+async def _stop(proc):
+    if proc.returncode is not None:
+        return
+    _signal(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), TERMINATE_GRACE)
+    except asyncio.TimeoutError:
+        _signal(proc, signal.SIGKILL)
+        await proc.wait()
+
+
+async def run_async(
+    cmd,
+    input=None,
+    timeout=None,
+    on_stdout=None,
+    on_stderr=None,
+    max_capture=MAX_CAPTURE,
+    **kwargs,
+):
+    """Run cmd (a shell string or an argv list) streaming its output.
+
+    Each line of output is passed to on_stdout/on_stderr as it arrives while
+    at most max_capture bytes per stream are kept for the Result. When the
+    timeout expires the process is terminated and subprocess.TimeoutExpired
+    raised.
+    """
+    result = Result(cmd=cmd, started=time.time())
+    kwargs.setdefault("start_new_session", True)
+    if isinstance(cmd, (list, tuple)):
+        create = asyncio.create_subprocess_exec(*cmd, **_pipes(input), **kwargs)
+    else:
+        create = asyncio.create_subprocess_shell(cmd, **_pipes(input), **kwargs)
+    proc = await create
+    _live.add(proc.pid)
+    out = _Capture(max_capture)
+    err = _Capture(max_capture)
+
+    async def feed():
+        if input is None:
+            return
+        try:
+            proc.stdin.write(input.encode("utf-8"))
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        proc.stdin.close()
+
+    async def communicate():
+        # stdin is fed while the output is read, a process writing before it
+        # read all of its input would otherwise block on a full pipe
+        await asyncio.gather(
+            feed(),
+            _pump(proc.stdout, out, on_stdout),
+            _pump(proc.stderr, err, on_stderr),
+        )
+        return await proc.wait()
+
+    try:
+        result.returncode = await asyncio.wait_for(communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+        if proc.stdin is not None:
+            proc.stdin.close()
+        await _stop(proc)
+        if isinstance(e, asyncio.CancelledError):
+            raise
+        raise subprocess.TimeoutExpired(
+            cmd, timeout, output=out.text(), stderr=err.text()
+        )
+    finally:
+        _live.discard(proc.pid)
+        result.finished = time.time()
+        result.stdout = out.text()
+        result.stderr = err.text()
+        result.output_bytes = out.total + err.total
+        result.truncated = out.truncated or err.truncated
+    return result
+
+
+def _pipes(input):
+    return dict(
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+def run(cmd, **kwargs):
+    """Blocking wrapper around run_async"""
+    return asyncio.run(run_async(cmd, **kwargs))
+
+
+async def _gather(calls, max_concurrency):
+    sem = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(cmd, kwargs):
+        async with sem:
+            return await run_async(cmd, **kwargs)
+
+    return await asyncio.gather(
+        *[bounded(cmd, kwargs) for cmd, kwargs in calls], return_exceptions=True
+    )
+
+
+def run_many(calls, max_concurrency=4):
+    """Run [(cmd, kwargs), ...] concurrently, returning a Result or the raised
+    exception for each call in order."""
+    return asyncio.run(_gather(calls, max_concurrency))
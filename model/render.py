@@ -125,26 +125,121 @@ class Renderer(list):
         return key in self.index
 
 
+def serialize(ent):
+    """Return the text DirectoryRenderer writes for an Output."""
+    data = ent.data
+    fmt = ent.annotations.get("format", "yaml")
+    if fmt == "yaml":
+        if not isinstance(data, list):
+            data = [data]
+        return "---\n" + yaml.dump_all(data)
+    elif fmt == "json":
+        return utils.dump(data)
+    elif fmt == "raw":
+        # In this case we should have pushed string data already in the proper format
+        return data
+    return ""
+
+
+def parse(text, fmt="yaml"):
+    """Inverse of serialize, used to compare outputs structurally."""
+    if fmt == "yaml":
+        return list(yaml.safe_load_all(text))
+    elif fmt == "json":
+        return json.loads(text)
+    return text
+
+
 class DirectoryRenderer(Renderer):
     def write(self):
+        self.write_entries(self)
+
+    def write_entries(self, entries):
         if not self.root.exists():
             self.root.mkdir()
-        for ent in self:
+        for ent in entries:
             ofn = (self.root / ent.name).resolve()
             ofn.parent.mkdir(mode=0o744, parents=True, exist_ok=True)
             with open(ofn, "w", encoding="utf-8") as fp:
-                data = ent.data
-                fmt = ent.annotations.get("format", "yaml")
-                if fmt == "yaml":
-                    if not isinstance(data, list):
-                        data = [data]
-                    print("---", file=fp)
-                    yaml.dump_all(data, stream=fp)
-                elif fmt == "json":
-                    fp.write(utils.dump(data))
-                elif fmt == "raw":
-                    # In this case we should have pushed string data already in the proper format
-                    fp.write(data)
+                fp.write(serialize(ent))
+
+
+class MemoryRenderer(Renderer):
+    """Keep the outputs in memory only, e.g. to apply them without writing
+    them out first."""
+
+    def __init__(self):
+        super().__init__("-")
+
+    def write(self):
+        pass
+
+
+class DiffRenderer(DirectoryRenderer):
+    """Compare the rendered outputs against a previous DirectoryRenderer output
+    and only write the added and changed entries. Removed entries are recorded
+    in a summary written alongside them."""
+
+    summary_name = ".model-diff.yaml"
+
+    def __init__(self, root=None, previous=None):
+        super().__init__(root)
+        self.previous = Path(previous)
+
+    def _previous_names(self):
+        names = set()
+        for fn in self.previous.rglob("*"):
+            if fn.is_file():
+                names.add(str(fn.relative_to(self.previous)))
+        names.discard(self.summary_name)
+        return names
+
+    def is_changed(self, ent):
+        fmt = ent.annotations.get("format", "yaml")
+        text = serialize(ent)
+        prev = (self.previous / ent.name).read_text(encoding="utf-8")
+        if text == prev:
+            return False
+        try:
+            return parse(text, fmt) != parse(prev, fmt)
+        except (ValueError, yaml.YAMLError):
+            # previous output isn't parsable, treat as changed
+            return True
+
+    def diff(self):
+        previous = self._previous_names()
+        summary = dict(added=[], changed=[], removed=[], unchanged=0)
+        for ent in sorted(self, key=lambda x: x.name):
+            if ent.name not in previous:
+                summary["added"].append(ent.name)
+            elif self.is_changed(ent):
+                summary["changed"].append(ent.name)
+            else:
+                summary["unchanged"] += 1
+            previous.discard(ent.name)
+        summary["removed"] = sorted(previous)
+        return summary
+
+    def write(self):
+        summary = self.diff()
+        names = set(summary["added"]) | set(summary["changed"])
+        entries = [e for e in sorted(self, key=lambda x: x.name) if e.name in names]
+        if str(self.root) == "-":
+            with streamer(self.root) as fp:
+                for ent in entries:
+                    text = serialize(ent)
+                    if not text.startswith("---"):
+                        text = "---\n" + text
+                    fp.write(text if text.endswith("\n") else text + "\n")
+                # the summary trails the stream as a comment
+                for line in yaml.dump(summary).splitlines():
+                    print(f"# {line}", file=fp)
+        else:
+            self.write_entries(entries)
+            with open(self.root / self.summary_name, "w", encoding="utf-8") as fp:
+                yaml.dump(summary, stream=fp)
+        self.summary = summary
+        return summary
 
 
 class FileRenderer(Renderer):
@@ -12,12 +12,29 @@ from . import config
 from . import docker
 from . import exceptions
 from . import render
+from . import template
 from . import utils
 
 log = logging.getLogger(__name__)
 _marker = object()
 _plugins = {}
 _runtimes = {}
+_render_contexts = {}
+
+# Plugins shipped with model, by name. Modules are only imported when the
+# plugin is first resolved so optional dependencies (boto3, hvac) are only
+# paid for by runtimes using them.
+plugin_registry = {
+    "docker": "model.runtimes.docker.Docker",
+    "ec2": "model.runtimes.ec2.EC2",
+    "istio": "model.runtimes.istio.Istio",
+    "kubernetes": "model.runtimes.kubernetes.Kubernetes",
+    "kustomize": "model.runtimes.kustomize.Kustomize",
+    "vault": "model.runtimes.vault.Vault",
+}
+# Third party packages can provide plugins under this entry point group
+# ex: entry_points={"model.runtimes": ["myplugin = mypackage.plugin:MyPlugin"]}
+PLUGIN_ENTRY_POINT_GROUP = "model.runtimes"
 
 
 def register(cls):
@@ -25,10 +42,45 @@ def register(cls):
     return cls
 
 
+def _entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return []
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+def lookup_plugin(name):
+    """Return the plugin class registered under name, importing it if needed."""
+    name = name.lower()
+    cls = _plugins.get(name)
+    if cls is not None:
+        return cls
+    path = plugin_registry.get(name)
+    if path:
+        log.debug(f"loading plugin {name}::{path}")
+        cls = utils.import_object(path)
+    else:
+        for ep in _entry_points(PLUGIN_ENTRY_POINT_GROUP):
+            if ep.name.lower() == name:
+                log.debug(f"loading plugin {name} from entry point {ep.value}")
+                cls = ep.load()
+                break
+    if cls is None:
+        raise exceptions.ConfigurationError(f"Unknown runtime plugin {name}")
+    _plugins[name] = cls
+    return cls
+
+
 @dataclass
 class RuntimePlugin:
     name: str
     config: dict = field(init=False, default_factory=utils.AttrAccess)
+    # render_service only adds/updates outputs and can be replayed by a RenderCache
+    cacheable = False
 
 
 @dataclass(unsafe_hash=True)
@@ -36,6 +88,10 @@ class RuntimeImpl:
     name: str = field(hash=True)
     kind: str = field(init=False, hash=True, default="RuntimeImpl")
     plugins: List[RuntimePlugin] = field(hash=False)
+    # (method, graph, service) -> address(es), reset as each render starts
+    _addr_memo: dict = field(
+        init=False, hash=False, compare=False, repr=False, default_factory=dict
+    )
 
     def __post_init__(self):
         for p in self.plugins:
@@ -75,20 +131,116 @@ class RuntimeImpl:
             raise TypeError(f"method_lookup() expect to find a method")
         return m
 
+    def _memoized(self, name, service, graph):
+        key = (name, getattr(graph, "name", None), service.name)
+        val = self._addr_memo.get(key, _marker)
+        if val is _marker:
+            # raises AttributeError when no plugin resolves addresses this way
+            m = self.lookup(name)
+            val = self._addr_memo[key] = m(service, graph)
+        return val
+
+    def service_addr(self, service, graph):
+        return self._memoized("service_addr", service, graph)
+
+    def service_addrs(self, service, graph):
+        return self._memoized("service_addrs", service, graph)
+
+    def reset(self):
+        """Drop state scoped to a single render."""
+        self._addr_memo.clear()
+
     def __getattr__(self, key):
         return self.lookup(key)
 
 
-def render_graph(graph, outputs):
+class ServiceRenderContext:
+    """Resolved view of a Service shared by the runtime plugins.
+
+    Each value is interpolated on first access and then reused for the
+    remainder of the render.
+    """
+
+    def __init__(self, service):
+        self.service = service
+        self._cache = {}
+
+    def _resolve(self, key, fn):
+        val = self._cache.get(key, _marker)
+        if val is _marker:
+            val = self._cache[key] = fn()
+        return val
+
+    @property
+    def config(self):
+        return self._resolve("config", self.service.full_config)
+
+    @property
+    def relations(self):
+        return self._resolve("relations", self.service.full_relations)
+
+    @property
+    def secrets(self):
+        return self._resolve(
+            "secrets", lambda: self.service.full_relations(secrets=True)
+        )
+
+    @property
+    def ports(self):
+        return self._resolve("ports", lambda: self.service.ports)
+
+    @property
+    def files(self):
+        return self._resolve("files", lambda: self.service.files)
+
+    @property
+    def environment(self):
+        return self.config.get("environment", [])
+
+    def endpoint_ports(self, name):
+        return [p for p in self.ports if p["name"] == name]
+
+
+def render_context(service):
+    """Return the ServiceRenderContext for service in the current render."""
+    ctx = _render_contexts.get(id(service))
+    if ctx is None:
+        ctx = _render_contexts[id(service)] = ServiceRenderContext(service)
+    return ctx
+
+
+def template_uris(graph):
+    """Every location a template referenced by the graph's services is looked up in."""
+    uris = set()
+    extra = graph.environment.entity if graph.environment else None
+    for service in graph.services:
+        for filespec in service.files:
+            name = filespec.get("template")
+            if not name:
+                continue
+            uris.update(service.entity.file_search_path(name))
+            if extra is not None:
+                uris.update(extra.file_search_path(name))
+    return uris
+
+
+def render_graph(graph, outputs, cache=None):
     # TODO: split the rendering of relations to support 1/2 living in another runtime
     #       ex render_relation_ep(relation.ep)
+    _render_contexts.clear()
+    # Remote templates are fetched (or revalidated) together up front
+    template.prefetch(template_uris(graph))
     runtimes = set()
     # 1st collect all the runtimes referenced in the graph
     for obj in graph.services:
+        # relation views hold interpolated addresses and secrets of the
+        # previous render
+        obj.reset()
         if obj.runtime is not None:
             runtimes.add(obj.runtime)
 
     for runtime in runtimes:
+        runtime.reset()
         for plugin in runtime.plugins:
             m = getattr(plugin, "init", None)
             if m:
@@ -106,7 +258,11 @@ def render_graph(graph, outputs):
                 kind = obj.kind.lower()
                 mn = f"{phase}render_{kind}"
                 m = getattr(plugin, mn, None)
-                if m:
+                if not m:
+                    continue
+                if cache is not None and mn == "render_service" and plugin.cacheable:
+                    cache.render_service(plugin, m, obj, graph, outputs)
+                else:
                     m(obj, graph, outputs)
         for obj in graph.relations:
             for endpoint in obj.endpoints:
@@ -152,28 +308,24 @@ def resolve_plugins(plugins):
     impls = []
     ctx = config.get_context()
     for p in plugins:
-        plug = None
         name = p.get("name", "").lower()
         path = p.get("path")
         package = p.get("package")
         if path:
             log.debug(f"loading plugin {name}::{path}")
             cls = utils.import_object(path, package=package)
-            plug = cls()
             if not name:
-                name = plug.__class__.__name__.lower()
-            _plugins[name] = plug
-            log.debug(f"loaded plugin {name}::{plug}")
+                name = cls.__name__.lower()
+            _plugins[name] = cls
+        elif name:
+            cls = lookup_plugin(name)
         else:
-            if name not in _plugins:
-                # attempt to load it from the runtimes submodule
-                utils.import_submodules("model.runtimes")
-                plug = _plugins[name]()
+            raise exceptions.ConfigurationError(f"Unable to resolve {p}")
+        plug = cls()
+        log.debug(f"loaded plugin {name}::{plug}")
         cfg = p.get("config")
         if cfg:
             cfg = utils.interpolate(cfg, ctx)
             plug.config.update(cfg)
-        if plug is None:
-            raise exceptions.ConfigurationError(f"Unable to resolve {p}")
         impls.append(plug)
     return impls
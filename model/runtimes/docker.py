@@ -1,3 +1,5 @@
+import base64
+import json
 from dataclasses import dataclass, field
 
 from .. import docker
@@ -24,13 +26,19 @@ class Docker(RuntimePlugin):
             self.cfg = cfg
 
     def image_secrets_for(self, image):
-        m = docker.parse_docker_tag(image)
+        # pinned images (tag@digest) use the registry of their tag
+        m = docker.parse_docker_tag(image.partition("@")[0])
         if not m or m["domain"] not in self.auths:
             return None
-        r = utils.AttrAccess(
-            auth=docker.auth_for(self.cfg, m["domain"]),
-            key=f"{self.graph.name}-{m['domain']}",
-        )
-        self.image_pull_secrets[r.key] = r
+        # One pull secret per registry domain and graph
+        key = f"{self.graph.name}-{m['domain']}"
+        r = self.image_pull_secrets.get(key)
+        if r is None:
+            auth = docker.auth_for(self.cfg, m["domain"])
+            r = utils.AttrAccess(
+                auth=auth,
+                key=key,
+                dockerconfigjson=base64.b64encode(json.dumps(auth).encode("utf-8")),
+            )
+            self.image_pull_secrets[key] = r
         return r
-
@@ -1,5 +1,6 @@
 from dataclasses import dataclass, field
 import logging
+import time
 
 import boto3
 
@@ -18,6 +19,7 @@ class EC2(RuntimePlugin):
     name: str = field(init=False, default="ec2")
     expose = {"cloud"}
     ingest = set()
+    DEFAULT_TTL = 60
 
     def __init__(self, **kwargs):
         # Check that we have connectivity to a region
@@ -28,6 +30,10 @@ class EC2(RuntimePlugin):
         self.asg = boto3.client("autoscaling")
         self.elb = boto3.client("elb")
         self.config = {}
+        self._addrs = {}  # graph name -> (expires, {service name: [addrs]})
+
+    def init(self, graph, outputs):
+        self.discover(graph)
 
     def get_instance_by_tags(self, **kwargs):
         flist = [{"Name": f"tag:{k}", "Values": [v]} for k, v in kwargs.items()]
@@ -67,22 +73,76 @@ class EC2(RuntimePlugin):
                 output.setdefault(asg["AutoScalingGroupName"], []).append(r)
         return output
 
+    def _tagged_services(self, graph):
+        for service in graph.services:
+            rt = service.runtime
+            if rt is None or not any(p is self for p in rt.plugins):
+                continue
+            tags = service.get("tags", {})
+            if tags:
+                yield service.name, {k: str(v) for k, v in tags.items()}
+
+    def _discovery_filters(self, services):
+        # Filters AND together while values OR, so tags every service has
+        # can be queried together. Otherwise fall back to matching on tag keys.
+        tagsets = list(services.values())
+        common = set.intersection(*[set(t) for t in tagsets])
+        if common:
+            return [
+                {"Name": f"tag:{k}", "Values": sorted({t[k] for t in tagsets})}
+                for k in sorted(common)
+            ]
+        keys = sorted({k for t in tagsets for k in t})
+        return [{"Name": "tag-key", "Values": keys}]
+
+    def discover(self, graph):
+        """Resolve the addresses of all tagged EC2 services in graph with a
+        single paginated describe_instances. Results are cached for cache_ttl."""
+        now = time.monotonic()
+        expires, addrs = self._addrs.get(graph.name, (0, None))
+        if expires > now:
+            return addrs
+
+        services = dict(self._tagged_services(graph))
+        addrs = {name: [] for name in services}
+        if services:
+            filters = self._discovery_filters(services)
+            log.debug(f"discovering ec2 instances for {list(services)}: [{filters}]")
+            paginator = self.ec2.get_paginator("describe_instances")
+            for page in paginator.paginate(Filters=filters):
+                for reservation in page["Reservations"]:
+                    for instance in reservation["Instances"]:
+                        address = instance.get("PrivateIpAddress")
+                        if not address:
+                            continue
+                        itags = {
+                            t["Key"]: t["Value"] for t in instance.get("Tags", [])
+                        }
+                        for name, tags in services.items():
+                            if all(itags.get(k) == v for k, v in tags.items()):
+                                addrs[name].append(address)
+        ttl = float(self.config.get("cache_ttl", self.DEFAULT_TTL))
+        self._addrs[graph.name] = (now + ttl, addrs)
+        return addrs
+
     def service_addrs(self, service, graph):
         # Here we map between tagged instances in the EC2 tag namespace
         # and their PrivateIPAddress to return the set of addresses
         # the service should include
+        # XXX: If we have lbs (see get_lb_for_asg) we can use DNSName here for the
+        # address. (if we want to connect over public) but using the lb here makes
+        # sense sometimes
+        addrs = self.discover(graph)
+        if service.name in addrs:
+            return list(addrs[service.name])
         tags = service.get("tags", {})
         if not tags:
             return []
         ins = self.get_instance_by_tags(**tags)
-        try:
-            asgs = self.instances_in_asg(ins)
-            lbs = self.lb_for_asg(*asgs["asg"].keys())
-        except Exception as e:
-            pass
-        # XXX: If we have lbs we can use DNSName here for the address. (if we want to connect over public)
-        # but using the lb here makes sense sometimes
         return [i["PrivateIpAddress"] for i in ins]
 
     def service_addr(self, service, graph):
-        return self.service_addrs(service, graph)[0]
+        addrs = self.service_addrs(service, graph)
+        if not addrs:
+            return None
+        return addrs[0]
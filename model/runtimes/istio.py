@@ -3,13 +3,14 @@ from dataclasses import dataclass, field
 from .. import docker
 from .. import exceptions
 from .. import utils
-from ..runtime import register, RuntimePlugin
+from ..runtime import register, render_context, RuntimePlugin
 
 
 @register
 @dataclass
 class Istio(RuntimePlugin):
     name: str = field(init=False, default="Istio")
+    cacheable = True
 
     def init(self, graph, output):
         gateway = {
@@ -41,8 +42,10 @@ class Istio(RuntimePlugin):
         if not exposed:
             return
 
+        ctx = render_context(service)
         public_dns = graph.environment.config["public_dns"]
         for ep in service.exposed_endpoints:
+            ports = ctx.endpoint_ports(ep.name)
             vs = {
                 "apiVersion": "networking.istio.io/v1alpha3",
                 "kind": "VirtualService",
@@ -58,7 +61,7 @@ class Istio(RuntimePlugin):
                                         # this is a general problem
                                         "host": f"{service.name}.{graph.name}.svc.cluster.local",
                                         # XXX: single port at random from set, come on...
-                                        "port": {"number": int(ep.ports[0].port)},
+                                        "port": {"number": int(ports[0].port)},
                                     }
                                 }
                             ],
@@ -1,5 +1,4 @@
-import base64
-import json
+import copy
 from dataclasses import dataclass, field
 from pathlib import Path
 
@@ -7,7 +6,7 @@ from ..config import get_model_config
 from .. import docker
 from .. import exceptions
 from .. import utils
-from ..runtime import register, RuntimePlugin
+from ..runtime import register, render_context, RuntimePlugin
 
 
 cfg = get_model_config()
@@ -19,16 +18,25 @@ class Kubernetes(RuntimePlugin):
     name: str = field(init=False, default="Kubernetes")
     expose = {"overlay", "ingress"}
     ingest = {"consul", "cloud"}
+    cacheable = True
+
+    def cache_key(self, service, graph):
+        # The rendered image pull secret depends on the local docker auth
+        docker = self.runtime_impl.plugin("Docker")
+        if docker:
+            return docker.image_secrets_for(service.image)
+        return None
 
     def service_addr(self, service, graph):
         return f"{service.name}.{graph.name}.svc.cluster.local"
 
     def config_map_for(self, service):
-        cm = dict(config=service.full_config(), relations=service.full_relations())
+        ctx = render_context(service)
+        cm = dict(config=ctx.config, relations=ctx.relations)
         return cm
 
     def secrets_for(self, service):
-        secrets = dict(relations=service.full_relations(secrets=True))
+        secrets = dict(relations=render_context(service).secrets)
         return secrets
 
     def add_namespace(self, graph, output):
@@ -147,7 +155,7 @@ class Kubernetes(RuntimePlugin):
             )
 
         # Handle any files which should be templatized and mapped into the container
-        for filespec in service.files:
+        for filespec in render_context(service).files:
             template = filespec.get("template")
             container_path = filespec.get("container_path")
             if not template:
@@ -318,11 +326,7 @@ class Kubernetes(RuntimePlugin):
                         "name": utils.filename_to_label(pull_secret.key),
                         "namespace": graph.name,
                     },
-                    "data": {
-                        ".dockerconfigjson": base64.b64encode(
-                            json.dumps(pull_secret.auth).encode("utf-8")
-                        )
-                    },
+                    "data": {".dockerconfigjson": pull_secret.dockerconfigjson},
                     "type": "kubernetes.io/dockerconfigjson",
                 }
                 output.add(
@@ -331,6 +335,7 @@ class Kubernetes(RuntimePlugin):
 
     def add_probes_from_endpoints(self, service, container_spec):
         epspecs = service.entity.get("endpoints")
+        ctx = render_context(service)
         for ep in service.endpoints.values():
             epspec = utils.pick(epspecs, name=ep.name)
             if not epspec:
@@ -354,14 +359,15 @@ class Kubernetes(RuntimePlugin):
                 payload["failureThreshold"] = failureThreshold
                 payload["periodSeconds"] = period
                 result = {probeKey: payload}
+                ports = ctx.endpoint_ports(ep.name)
                 if ep.interface.isA("http", "server"):
                     payload["httpGet"] = {
                         "path": path,
                         # FIXME: again with the [0]
-                        "port": ep.ports[0].port,
+                        "port": ports[0].port,
                     }
-                elif ep.ports[0].protocol == "TCP":
-                    payload["tcpSocket"] = {"port": ep.ports[0].port}
+                elif ports[0].protocol == "TCP":
+                    payload["tcpSocket"] = {"port": ports[0].port}
                 else:
                     payload["exec"] = {"command": list(command)}
 
@@ -429,6 +435,7 @@ class Kubernetes(RuntimePlugin):
         initContainers.append(init_container)
 
     def render_service(self, service, graph, output):
+        ctx = render_context(service)
         labels = {
             "app.kubernetes.io/name": service.name,
             "app.kubernetes.io/instance": f"{graph.name}-{service.name}-{service.version}",
@@ -469,13 +476,14 @@ class Kubernetes(RuntimePlugin):
             default_container["args"] = args
 
         # push out a deployment
-        ports = service.ports
+        ports = ctx.ports
         # XXX: Protocol support
         dports = []
         for p in ports:
             dports.append(dict(containerPort=int(p["port"]), protocol=p["protocol"]))
 
-        senv = service.full_config().get("environment", [])
+        # The config map shares this data, don't let deployment edits leak into it
+        senv = copy.deepcopy(ctx.environment)
         if dports:
             default_container["ports"] = dports
         if senv:
@@ -527,7 +535,7 @@ class Kubernetes(RuntimePlugin):
 
         # next push out a service object
         ports = []
-        for p in service.ports:
+        for p in ctx.ports:
             ports.append(
                 {"protocol": p["protocol"], "name": p["name"], "port": int(p["port"])}
             )
@@ -4,7 +4,7 @@ from .. import docker
 from .. import exceptions
 from .. import render
 from .. import utils
-from ..runtime import register, RuntimePlugin
+from ..runtime import register, render_context, RuntimePlugin
 
 
 @register
@@ -19,6 +19,9 @@ class Kustomize(RuntimePlugin):
             {"resources": [], "configMapGenerator": [], "secretGenerator": []},
             self,
         )
+        # Generator entries are collected per render and merged into the
+        # kustomization once in fini(), merging per service is quadratic.
+        self.generators = {"configMapGenerator": [], "secretGenerator": []}
 
     def render_service(self, service, graph, output):
         # For each service we inject a config-map for use in configuring
@@ -36,12 +39,7 @@ class Kustomize(RuntimePlugin):
             files=[f"configs/{graph.name}-{service.name}-config.json"],
         )
 
-        output.update(
-            self.fn,
-            data={"data.configMapGenerator": [context]},
-            plugin=self,
-            schema={"mergeStrategy": "append"},
-        )
+        self.generators["configMapGenerator"].append(context)
 
         context = dict(
             name=f"{service.name}-secrets",
@@ -49,16 +47,11 @@ class Kustomize(RuntimePlugin):
             files=[f"configs/{graph.name}-{service.name}-secrets.json"],
         )
 
-        output.update(
-            self.fn,
-            data={"data.secretGenerator": [context]},
-            plugin=self,
-            schema={"mergeStrategy": "append"},
-        )
+        self.generators["secretGenerator"].append(context)
 
         # If the service has "files" which should be mapped into the container
         # this will be registered here as well
-        for file in service.files:
+        for file in render_context(service).files:
             fn = file.get("template")
             fn = utils.filename_to_label(fn)
             context = dict(
@@ -67,14 +60,15 @@ class Kustomize(RuntimePlugin):
                 files=[f"resources/{graph.name}-{service.name}-{fn}"],
             )
 
-            output.update(
-                self.fn,
-                data={"data.configMapGenerator": [context]},
-                plugin=self,
-                schema={"mergeStrategy": "append"},
-            )
+            self.generators["configMapGenerator"].append(context)
 
     def fini(self, graph, output):
+        output.update(
+            self.fn,
+            data={f"data.{k}": v for k, v in self.generators.items()},
+            plugin=self,
+            schema={"mergeStrategy": "append"},
+        )
         # XXX: temp workaround till we assign outputs to layers
         if isinstance(output, render.FileRenderer):
             return
@@ -1,4 +1,9 @@
 from dataclasses import dataclass, field
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import hvac
 
@@ -9,26 +14,91 @@ from .. import render
 from .. import utils
 from ..runtime import register, RuntimePlugin
 
+log = logging.getLogger(__name__)
+
+# matches vault['src:path'] style references in interpolated strings
+_vault_ref = re.compile(r"""vault\[\s*(?P<q>['"])(?P<path>.+?)(?P=q)\s*\]""")
+
+
+def find_vault_paths(data, paths=None):
+    """Collect the vault paths referenced by any string in data."""
+    if paths is None:
+        paths = set()
+    if isinstance(data, str):
+        for m in _vault_ref.finditer(data):
+            paths.add(m.group("path"))
+    elif isinstance(data, dict):
+        for v in data.values():
+            find_vault_paths(v, paths)
+    elif isinstance(data, (list, tuple, set)):
+        for v in data:
+            find_vault_paths(v, paths)
+    return paths
+
 
 class VaultProxy:
-    def __init__(self, **kwargs):
+    DEFAULT_TTL = 300
+    DEFAULT_WORKERS = 8
+
+    def __init__(self, ttl=DEFAULT_TTL, max_workers=DEFAULT_WORKERS, **kwargs):
         c = self.client = hvac.Client(**kwargs)
         if not c.is_authenticated():
             raise exceptions.ConfigurationError(f"Unable to connect vault client")
         self.src_map = {
             "kv": c.secrets.kv.v1.read_secret,
         }
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._cache = {}  # vault_path -> (expires, data)
+        self._lock = threading.Lock()
 
-    def __getitem__(self, vault_path):
-        # lookup path in the format [src:]<vault/path>
-        # This will return the value for the keyname or the whole dict of values if no
-        # keyname was specified.
+    def _read(self, vault_path):
         src, _, path = vault_path.rpartition(":")
         if not src:
             src = "kv"
         driver = self.src_map[src]
         obj = driver(path)
-        return utils.AttrAccess(obj["data"])
+        data = obj["data"]
+        with self._lock:
+            self._cache[vault_path] = (time.monotonic() + self.ttl, data)
+        return data
+
+    def _cached(self, vault_path):
+        with self._lock:
+            expires, data = self._cache.get(vault_path, (0, None))
+        if expires < time.monotonic():
+            return None
+        return data
+
+    def __getitem__(self, vault_path):
+        # lookup path in the format [src:]<vault/path>
+        # This will return the value for the keyname or the whole dict of values if no
+        # keyname was specified.
+        data = self._cached(vault_path)
+        if data is None:
+            data = self._read(vault_path)
+        return utils.AttrAccess(data)
+
+    def _prefetch_one(self, vault_path):
+        try:
+            self._read(vault_path)
+        except Exception as e:
+            # only an error once the secret is used
+            log.debug(f"unable to prefetch vault secret {vault_path}: {e}")
+
+    def prefetch(self, paths):
+        """Read every uncached path concurrently, paths that can't be read
+        are left to fail when they are used."""
+        missing = [p for p in set(paths) if self._cached(p) is None]
+        if not missing:
+            return
+        log.debug(f"prefetching {len(missing)} vault secrets")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            list(pool.map(self._prefetch_one, missing))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
 
 
 @register
@@ -43,11 +113,28 @@ class Vault(RuntimePlugin):
         # default object space for interpolation. In this case we want to add `vault`
         # to the context such that other objects can resolve from it
         # XXX: we'll need a global scope to reference in all context building
-        self.client = VaultProxy(**self.config)
+        cfg = dict(self.config)
+        ttl = int(cfg.pop("cache_ttl", VaultProxy.DEFAULT_TTL))
+        workers = int(cfg.pop("prefetch_workers", VaultProxy.DEFAULT_WORKERS))
+        self.client = VaultProxy(ttl=ttl, max_workers=workers, **cfg)
         # Add a global
         ctx = config.get_context()
         ctx["vault"] = self.client
 
+    def referenced_paths(self, objs):
+        paths = set()
+        for obj in objs:
+            ent = getattr(obj, "entity", obj)
+            m = getattr(ent, "serialized", None)
+            if callable(m):
+                find_vault_paths(m(), paths)
+        return paths
+
+    def init(self, graph, outputs):
+        # Read the secrets of the graph being rendered up front
+        objs = [graph.environment] + list(graph.services)
+        self.client.prefetch(self.referenced_paths(objs))
+
     def render_service(self, graph, outputs, service):
         # add configmap and tls secret to any service deployment spec
         # this will let us map secrets from vault into the FS as needed
@@ -1,24 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
 import requests
 import requests_file
+from requests.adapters import HTTPAdapter
+
+from jinja2 import Environment, BaseLoader, FileSystemBytecodeCache, TemplateNotFound
+
+log = logging.getLogger(__name__)
+
+# Number of compiled templates kept by the shared environment
+CACHE_SIZE = 400
+# Keep-alive connections kept per remote host
+POOL_SIZE = 16
+PREFETCH_WORKERS = 8
+TIMEOUT = 30
+
+_env = None
+_env_lock = threading.Lock()
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def is_remote(uri):
+    return isinstance(uri, str) and uri.startswith(("http://", "https://"))
+
 
-from jinja2 import Environment, BaseLoader, TemplateNotFound
+class HTTPCache:
+    """Remote documents and their ETag/Last-Modified validators.
+
+    Entries are kept in memory and, when a directory is given, on disk so
+    later runs only have to revalidate them.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, uri):
+        key = hashlib.sha256(uri.encode("utf-8")).hexdigest()
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, uri):
+        with self._lock:
+            entry = self._entries.get(uri)
+        if entry is not None or self.directory is None:
+            return entry
+        fn = self._entry_path(uri)
+        try:
+            entry = json.loads(fn.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self._entries[uri] = entry
+        return entry
+
+    def put(self, uri, body, etag=None, last_modified=None):
+        entry = dict(uri=uri, body=body, etag=etag, last_modified=last_modified)
+        with self._lock:
+            self._entries[uri] = entry
+        if self.directory is None or not (etag or last_modified):
+            return entry
+        fn = self._entry_path(uri)
+        fn.parent.mkdir(parents=True, exist_ok=True)
+        tmp = fn.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry), encoding="utf-8")
+        tmp.replace(fn)
+        return entry
+
+    def validators(self, uri):
+        headers = {}
+        entry = self.get(uri)
+        if not entry:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+class Fetcher:
+    """Fetch remote documents over pooled keep-alive sessions, revalidating
+    cached copies with conditional GETs."""
+
+    def __init__(self, cache=None, pool_size=POOL_SIZE):
+        self.cache = cache if cache is not None else HTTPCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # uri -> body (or None when missing) fetched by prefetch and not yet used
+        self._primed = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, uri):
+        headers = self.cache.validators(uri)
+        r = self.session.get(uri, headers=headers, timeout=TIMEOUT)
+        if r.status_code == requests.codes.not_modified and headers:
+            return self.cache.get(uri)["body"]
+        if r.status_code != requests.codes.ok:
+            return None
+        return self._store(uri, r)
+
+    def _store(self, uri, response):
+        entry = self.cache.put(
+            uri,
+            response.text,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        return entry["body"]
+
+    def get(self, uri):
+        """Return the body of uri or None if it doesn't exist."""
+        with self._lock:
+            if uri in self._primed:
+                return self._primed.pop(uri)
+        return self._fetch(uri)
+
+    def is_current(self, uri):
+        headers = self.cache.validators(uri)
+        if not headers:
+            return False
+        try:
+            r = self.session.get(uri, headers=headers, timeout=TIMEOUT)
+        except requests.RequestException:
+            return False
+        if r.status_code == requests.codes.not_modified:
+            return True
+        # Changed, keep the new body so reloading doesn't download it again
+        body = None
+        if r.status_code == requests.codes.ok:
+            body = self._store(uri, r)
+        with self._lock:
+            self._primed[uri] = body
+        return False
+
+    def _prime(self, uri):
+        try:
+            body = self._fetch(uri)
+        except requests.RequestException as e:
+            log.debug(f"prefetch of {uri} failed: {e}")
+            return
+        with self._lock:
+            self._primed[uri] = body
+
+    def prefetch(self, uris, max_workers=PREFETCH_WORKERS):
+        """Fetch (or revalidate) every remote uri concurrently."""
+        uris = sorted({u for u in uris if is_remote(u)})
+        if not uris:
+            return
+        log.debug(f"prefetching {len(uris)} remote templates")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(self._prime, uris))
 
 
 class URILoader(BaseLoader):
-    def __init__(self):
+    def __init__(self, fetcher=None):
         self.session = requests.Session()
         self.session.mount("file://", requests_file.FileAdapter())
+        self.fetcher = fetcher if fetcher is not None else Fetcher()
 
-    def get_source(self, environment, template):
-        r = self.session.get(template)
-        if not r.status_code == requests.codes.ok:
+    def _get_file_source(self, template):
+        path = urllib.request.url2pathname(urllib.parse.urlsplit(template).path)
+        mtime = _mtime(path)
+        if mtime is None:
             raise TemplateNotFound(template)
-        # TODO: check etags and similar with read uptodate function
+        with open(path, encoding="utf-8") as fp:
+            source = fp.read()
+        return (source, template, lambda: _mtime(path) == mtime)
+
+    def get_source(self, environment, template):
         # TODO: support dynamic search paths, in effect any entity can have its own search path
         # but we only want one environment.
-        return (r.text, template, lambda: True)
+        if template.startswith("file://"):
+            return self._get_file_source(template)
+        if not is_remote(template):
+            r = self.session.get(template)
+            if not r.status_code == requests.codes.ok:
+                raise TemplateNotFound(template)
+            return (r.text, template, lambda: False)
+        source = self.fetcher.get(template)
+        if source is None:
+            raise TemplateNotFound(template)
+        return (source, template, lambda: self.fetcher.is_current(template))
 
 
 def get_env():
-    return Environment(loader=URILoader())
+    """Return the process wide jinja2 Environment.
+
+    Compiled templates are cached (up to CACHE_SIZE) and reloaded when the
+    underlying file's mtime or the remote ETag/Last-Modified changes.
+    """
+    global _env
+    if _env is None:
+        with _env_lock:
+            if _env is None:
+                _env = Environment(loader=URILoader(), cache_size=CACHE_SIZE)
+    return _env
+
+
+def enable_bytecode_cache(directory):
+    """Persist compiled templates under directory.
+
+    Entries are keyed by the template URI and checked against a checksum of
+    its source, so a changed template is simply compiled again.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    get_env().bytecode_cache = FileSystemBytecodeCache(str(directory))
+
+
+def disable_bytecode_cache():
+    get_env().bytecode_cache = None
+
+
+def enable_http_cache(directory):
+    """Keep remote templates (and their validators) under directory."""
+    get_env().loader.fetcher.cache = HTTPCache(directory)
+
 
+def prefetch(uris):
+    get_env().loader.fetcher.prefetch(uris)
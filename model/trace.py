@@ -0,0 +1,68 @@
+import json
+import threading
+import time
+import uuid
+from pathlib import Path
+
+
+class Tracer:
+    """Collect timing spans, appending each to a JSON lines file when given."""
+
+    def __init__(self, path=None, **attrs):
+        self.path = Path(path) if path else None
+        # added to every span, e.g. the pipeline name
+        self.attrs = dict(run=uuid.uuid4().hex[:12], **attrs)
+        self.spans = []
+        self._lock = threading.Lock()
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, type, name, start, end=None, **attrs):
+        if end is None:
+            end = time.time()
+        span = dict(self.attrs)
+        span.update(
+            type=type, name=name, start=start, end=end, duration=end - start, **attrs
+        )
+        with self._lock:
+            self.spans.append(span)
+            if self.path:
+                with self.path.open("a", encoding="utf-8") as fp:
+                    fp.write(json.dumps(span, default=str) + "\n")
+        return span
+
+    def summary(self):
+        """Table of the segment spans and the commands they ran"""
+        commands = {}
+        for span in self.spans:
+            if span["type"] == "command":
+                commands.setdefault(span.get("segment"), []).append(span)
+        rows = [("segment", "status", "seconds", "commands", "output bytes")]
+        segments = sorted(
+            (s for s in self.spans if s["type"] == "segment"), key=lambda s: s["start"]
+        )
+        for span in segments:
+            cmds = commands.get(span["name"], [])
+            rows.append(
+                (
+                    span["name"],
+                    span.get("status", ""),
+                    f"{span['duration']:.1f}",
+                    str(len(cmds)),
+                    str(sum(c.get("output_bytes") or 0 for c in cmds)),
+                )
+            )
+        if segments:
+            wall = max(s["end"] for s in segments) - segments[0]["start"]
+            total = sum(s["duration"] for s in segments)
+            rows.append(("total", "", f"{wall:.1f}", f"({total:.1f} summed)", ""))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        lines = []
+        for row in rows:
+            lines.append(
+                "  ".join(
+                    c.ljust(w) if i < 2 else c.rjust(w)
+                    for i, (c, w) in enumerate(zip(row, widths))
+                ).rstrip()
+            )
+        return "\n".join(lines)
@@ -1,6 +1,7 @@
 import ast
 import copy
 import functools
+import hashlib
 import importlib
 import ipaddress
 import itertools
@@ -345,6 +346,24 @@ def dump(obj):
     return json.dumps(obj, default=_dumper, indent=2)
 
 
+def _fingerprint_default(obj):
+    m = getattr(obj, "serialized", None)
+    if callable(m):
+        return m()
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="backslashreplace")
+    # str() of other objects may include their id() or hide their state,
+    # giving keys that never hit or that collide
+    raise TypeError(f"unable to fingerprint {type(obj)}")
+
+
+def fingerprint(obj):
+    """sha256 of obj dumped as JSON. Objects are dumped with their serialized
+    method, TypeError is raised for those without one."""
+    data = json.dumps(obj, sort_keys=True, default=_fingerprint_default)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
 def apply_to_dataclass(cls, **kwargs):
     # filter kwargs such that only fields are present
     args = {}
@@ -24,7 +24,7 @@ setup(
     packages=find_packages(exclude=["ez_setup", "tests"]),
     package_data={"model": ["py.typed"]},
     include_package_data=True,
-    python_requires=">=3.7.0",
+    python_requires=">=3.8.0",
     keywords=[],
     zip_safe=False,
     install_requires=install_requires,
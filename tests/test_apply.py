@@ -0,0 +1,188 @@
+import base64
+import json
+import os
+import sys
+
+import pytest
+import yaml
+
+from model import apply
+
+FAKE_KUBECTL = """#!{python}
+import json, os, sys, time, yaml
+from pathlib import Path
+
+args = sys.argv[1:]
+if args[0] == "kustomize":
+    root = Path(args[1])
+    k = yaml.safe_load((root / "kustomization.yaml").read_text())
+    docs = []
+    for name in k["resources"]:
+        docs.extend(yaml.safe_load_all((root / name).read_text()))
+    for gen in k.get("configMapGenerator", []):
+        docs.append(dict(kind="ConfigMap", metadata=dict(name=gen["name"] + "-h4sh")))
+    print(yaml.safe_dump_all([d for d in docs if d]))
+    sys.exit()
+start = time.time()
+docs = list(yaml.safe_load_all(sys.stdin)) if args[0] == "apply" else []
+if args[0] == "apply":
+    time.sleep(0.3)
+with open({calls!r}, "a") as fp:
+    names = [d["metadata"]["name"] for d in docs] or args[1:]
+    fp.write(json.dumps([args[0], names, start, time.time()]) + "\\n")
+if any("bad" in n for n in names):
+    print("bad object", file=sys.stderr)
+    sys.exit(1)
+"""
+
+
+@pytest.fixture
+def kubectl(tmp_path, monkeypatch):
+    calls = tmp_path / "calls"
+    fn = tmp_path / "bin" / "kubectl"
+    fn.parent.mkdir()
+    fn.write_text(FAKE_KUBECTL.format(python=sys.executable, calls=str(calls)))
+    fn.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{fn.parent}{os.pathsep}{os.environ['PATH']}")
+    return calls
+
+
+def doc(kind, name):
+    return dict(kind=kind, metadata=dict(name=name, namespace="blog"))
+
+
+def test_wave_of():
+    assert apply.wave_of("00-blog-namespace.yaml") == 0
+    assert apply.wave_of("40-ghost-deployment.yaml") == 40
+    assert apply.wave_of("blog-registry.example.com") == apply.DEFAULT_WAVE
+
+
+def test_from_directory(kubectl, tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    files = {
+        "00-blog-namespace.yaml": [dict(kind="Namespace", metadata={"name": "blog"})],
+        "40-ghost-deployment.yaml": [doc("Deployment", "ghost")],
+        "50-ghost-service.yaml": [doc("Service", "ghost")],
+    }
+    for name, docs in files.items():
+        (out / name).write_text(yaml.safe_dump_all(docs))
+    kustomization = dict(
+        resources=sorted(files), configMapGenerator=[dict(name="ghost-config")]
+    )
+    (out / "kustomization.yaml").write_text(yaml.safe_dump(kustomization))
+
+    manifests = apply.from_directory(out)
+    planned = [
+        (wave, [(m.name, [d["metadata"]["name"] for d in m.docs]) for m in group])
+        for wave, group in apply.waves(manifests)
+    ]
+    assert planned == [
+        (0, [("00-blog-namespace.yaml", ["blog"])]),
+        (apply.DEFAULT_WAVE, [(apply.GENERATED, ["ghost-config-h4sh"])]),
+        (40, [("40-ghost-deployment.yaml", ["ghost"])]),
+        (50, [("50-ghost-service.yaml", ["ghost"])]),
+    ]
+
+
+def test_waves_applied_in_order_concurrently(kubectl):
+    manifests = [
+        apply.Manifest("00-ns.yaml", [dict(kind="Namespace", metadata={"name": "a"})]),
+        apply.Manifest("40-a-deployment.yaml", [doc("Deployment", "a")]),
+        apply.Manifest("40-b-deployment.yaml", [doc("Deployment", "b")]),
+        apply.Manifest("40-c-deployment.yaml", [doc("Deployment", "c")]),
+        apply.Manifest("50-a-service.yaml", [doc("Service", "a")]),
+    ]
+    assert apply.WaveApplier(max_parallel=3).apply(manifests)
+
+    calls = [json.loads(line) for line in kubectl.read_text().splitlines()]
+    assert calls[0][:2] == ["apply", ["a"]]
+    assert calls[1][0] == "wait" and calls[1][1][-1] == "namespace/a"
+    deployments = calls[2:5]
+    assert sorted(n for c in deployments for n in c[1]) == ["a", "b", "c"]
+    # only the namespace wave was waited for and the service came last
+    assert calls[5][:2] == ["apply", ["a"]] and len(calls) == 6
+    assert calls[5][2] >= max(c[3] for c in deployments)
+    # the deployments were applied at once
+    assert max(c[2] for c in deployments) < min(c[3] for c in deployments)
+
+
+def test_failed_wave_stops_apply(kubectl):
+    manifests = [
+        apply.Manifest("40-bad-deployment.yaml", [doc("Deployment", "bad")]),
+        apply.Manifest("40-ok-deployment.yaml", [doc("Deployment", "ok")]),
+        apply.Manifest("50-service.yaml", [doc("Service", "ok")]),
+    ]
+    assert not apply.WaveApplier().apply(manifests)
+    calls = [json.loads(line) for line in kubectl.read_text().splitlines()]
+    assert sorted(n for c in calls for n in c[1]) == ["bad", "ok"]
+
+
+def test_name_hash_matches_kustomize():
+    doc = dict(
+        kind="ConfigMap",
+        metadata=dict(name="example-configmap-1"),
+        data={"application.properties": "FOO=Bar\n"},
+    )
+    assert apply.name_hash(doc) == "8mbdf7882g"
+    doc = dict(
+        kind="ConfigMap", metadata=dict(name="example-configmap-2"), data={"FOO": "Bar"}
+    )
+    assert apply.name_hash(doc) == "g2hdhfc6tk"
+
+
+def test_from_outputs_generates_in_process():
+    from model import render
+
+    ren = render.MemoryRenderer()
+    namespace = dict(kind="Namespace", metadata={"name": "blog"})
+    ren.add("00-blog-namespace.yaml", namespace, None)
+    deployment = doc("Deployment", "ghost")
+    deployment["spec"] = dict(
+        imagePullSecrets=[dict(name="ghost-secrets")],
+        volumes=[
+            dict(name="config", configMap=dict(name="ghost-config")),
+            dict(name="secrets", secret=dict(secretName="ghost-secrets")),
+            dict(name="other", configMap=dict(name="unrelated")),
+        ],
+    )
+    ren.add("40-ghost-deployment.yaml", deployment, None)
+    ren.add("configs/blog-ghost-config.json", {"port": 2368}, None, format="json")
+    ren.add("configs/blog-ghost-secrets.json", {"password": "x"}, None, format="json")
+    ren.add(
+        "kustomization.yaml",
+        dict(
+            resources=["00-blog-namespace.yaml", "40-ghost-deployment.yaml"],
+            configMapGenerator=[
+                dict(
+                    name="ghost-config",
+                    namespace="blog",
+                    files=["configs/blog-ghost-config.json"],
+                )
+            ],
+            secretGenerator=[
+                dict(
+                    name="ghost-secrets",
+                    namespace="blog",
+                    files=["configs/blog-ghost-secrets.json"],
+                )
+            ],
+        ),
+        None,
+    )
+    ren.write()
+
+    manifests = {m.name: m for m in apply.from_outputs(ren)}
+    assert [w for w, _ in apply.waves(manifests.values())] == [0, 30, 40]
+    config, secret = manifests[apply.GENERATED].docs
+    assert config["metadata"]["name"].startswith("ghost-config-")
+    assert config["data"] == {"blog-ghost-config.json": '{\n  "port": 2368\n}'}
+    assert secret["type"] == "Opaque"
+    data = base64.b64decode(secret["data"]["blog-ghost-secrets.json"])
+    assert json.loads(data) == {"password": "x"}
+
+    spec = manifests["40-ghost-deployment.yaml"].docs[0]["spec"]
+    assert spec["imagePullSecrets"][0]["name"] == secret["metadata"]["name"]
+    assert spec["volumes"][0]["configMap"]["name"] == config["metadata"]["name"]
+    assert spec["volumes"][1]["secret"]["secretName"] == secret["metadata"]["name"]
+    assert spec["volumes"][2]["configMap"]["name"] == "unrelated"
@@ -0,0 +1,94 @@
+from dataclasses import dataclass, field
+
+import pytest
+
+from model import cache
+from model import entity
+from model import render
+from model import runtime
+from model import utils
+
+
+@dataclass
+class Echo(runtime.RuntimePlugin):
+    name: str = field(init=False, default="Echo")
+    calls: int = field(init=False, default=0)
+    cacheable = True
+
+    def render_service(self, service, graph, output):
+        self.calls += 1
+        data = {"image": service.image, "auth": b"secret"}
+        output.add(f"{service.name}.yaml", data, self, service=service, graph=graph)
+
+
+class FakeService:
+    name = "web"
+    image = "nginx:1"
+    files = []
+    ports = []
+
+    def __init__(self):
+        self.entity = entity.Entity(dict(name="web", kind="Component"))
+
+    def full_config(self):
+        return {"environment": []}
+
+    def full_relations(self, secrets=False):
+        return {}
+
+
+@pytest.fixture
+def graph():
+    return utils.AttrAccess(name="blog", environment=utils.AttrAccess(config={}))
+
+
+def test_render_cache_replays_outputs(tmp_path, graph):
+    service = FakeService()
+    plugin = Echo()
+
+    first = render.Renderer(tmp_path)
+    rc = cache.RenderCache(tmp_path / "cache")
+    rc.render_service(plugin, plugin.render_service, service, graph, first)
+    assert rc.stats() == dict(hits=0, misses=1, hit_rate=0.0)
+
+    second = render.Renderer(tmp_path)
+    rc = cache.RenderCache(tmp_path / "cache")
+    rc.render_service(plugin, plugin.render_service, service, graph, second)
+    assert rc.hits == 1
+    assert plugin.calls == 1
+    assert second[0].data == first[0].data
+    assert second[0].annotations["service"] is service
+    assert second[0].annotations["graph"] is graph
+
+
+def test_render_cache_location():
+    rc = cache.RenderCache.for_output("/tmp/deploy/base")
+    assert str(rc.path) == "/tmp/deploy/.base-render-cache"
+
+
+def test_fingerprint_rejects_unknown_objects(tmp_path, graph):
+    service = FakeService()
+    plugin = Echo()
+    plugin.config = {"opaque": object()}
+    rc = cache.RenderCache(tmp_path / "cache")
+    with pytest.raises(TypeError):
+        rc.fingerprint(plugin, service, graph)
+    # rendered without the cache
+    outputs = render.Renderer(tmp_path)
+    rc.render_service(plugin, plugin.render_service, service, graph, outputs)
+    assert plugin.calls == 1 and rc.misses == 0
+
+
+def test_prune_unused_entries(tmp_path, graph):
+    service = FakeService()
+    plugin = Echo()
+    rc = cache.RenderCache(tmp_path / "cache")
+    outputs = render.Renderer(tmp_path)
+    rc.render_service(plugin, plugin.render_service, service, graph, outputs)
+    rc.save("ab" + "0" * 62, [])
+    assert rc.prune() == 1
+    assert [fn.stem for fn in rc.path.glob("*/*.yaml")] == list(rc.used)
+
+    # a later render not using the entry prunes it
+    assert cache.RenderCache(rc.path).prune() == 1
+    assert not list(rc.path.iterdir())
@@ -0,0 +1,74 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+# Modules only subcommands should pay for
+HEAVY_MODULES = [
+    "aiohttp",
+    "boto3",
+    "hvac",
+    "rich",
+    "model.graph",
+    "model.pipeline",
+    "model.render",
+    "model.runtime",
+    "model.server",
+]
+# cumulative import time of model.cli.main in microseconds
+STARTUP_BUDGET = 400000
+
+
+def importtime(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=Path(__file__).parent.parent,
+        stderr=subprocess.PIPE,
+        encoding="utf-8",
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            # header line
+            continue
+    return times
+
+
+def test_cli_startup_imports():
+    times = importtime("model.cli.main")
+    loaded = [m for m in HEAVY_MODULES if m in times]
+    assert not loaded, f"CLI startup imports {loaded}"
+    assert times["model.cli.main"] < STARTUP_BUDGET
+
+
+def test_cache_clear(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+
+    from model.cli import main
+
+    cache_dir = tmp_path / "cache"
+    (cache_dir / "templates").mkdir(parents=True)
+    render_cache = tmp_path / ".out-render-cache"
+    render_cache.mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".model.conf").write_text(f"cache:\n  dir: {cache_dir}\n")
+
+    (cache_dir / "digests.json").write_text("{}")
+    (cache_dir / "pipelines").mkdir()
+
+    result = CliRunner().invoke(main.main, ["cache", "clear", "-o", "out"])
+    assert result.exit_code == 0, result.output
+    assert [p.name for p in cache_dir.iterdir()] == ["pipelines"]
+    assert not render_cache.exists()
+
+    result = CliRunner().invoke(main.main, ["cache", "clear", "--pipelines"])
+    assert result.exit_code == 0, result.output
+    assert not list(cache_dir.iterdir())
@@ -0,0 +1,129 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model import digest
+
+
+def test_image_reference():
+    assert digest.image_reference("ghost:3-alpine") == (
+        "docker.io",
+        "library/ghost",
+        "3-alpine",
+    )
+    assert digest.image_reference("nginxdemos/hello") == (
+        "docker.io",
+        "nginxdemos/hello",
+        "latest",
+    )
+    assert digest.image_reference("registry.example.com/org/app:1.0") == (
+        "registry.example.com",
+        "org/app",
+        "1.0",
+    )
+    assert digest.image_reference("localhost:5000/app:2") == (
+        "localhost:5000",
+        "app",
+        "2",
+    )
+
+
+class Registry(BaseHTTPRequestHandler):
+    digests = {"app/web:1.0": "sha256:" + "a" * 64, "app/db:2": "sha256:" + "b" * 64}
+    requests = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # token endpoint
+        self.requests["token"] += 1
+        data = json.dumps({"token": "secret"}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        if self.headers.get("Authorization") != "Bearer secret":
+            host = self.headers["Host"]
+            self.send_response(401)
+            self.send_header(
+                "WWW-Authenticate",
+                f'Bearer realm="http://{host}/token",service="registry"',
+            )
+            self.end_headers()
+            return
+        _, _, path = self.path.partition("/v2/")
+        repo, _, tag = path.partition("/manifests/")
+        self.requests["manifest"] += 1
+        found = self.digests.get(f"{repo}:{tag}")
+        if not found:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Docker-Content-Digest", found)
+        self.end_headers()
+
+
+@pytest.fixture
+def registry():
+    Registry.requests.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Registry)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_resolve_many_cached(registry, tmp_path):
+    images = [f"{registry}/app/web:1.0", f"{registry}/app/db:2"]
+    missing = f"{registry}/app/missing:3"
+    cache_file = tmp_path / "digests.json"
+
+    resolver = digest.DigestResolver(digest.DigestCache(cache_file))
+    digests = resolver.resolve_many(images + [missing, images[0]])
+    assert digests == {
+        images[0]: Registry.digests["app/web:1.0"],
+        images[1]: Registry.digests["app/db:2"],
+    }
+    assert Registry.requests["manifest"] == 3
+
+    # the next run is served from disk
+    Registry.requests.clear()
+    resolver = digest.DigestResolver(digest.DigestCache(cache_file))
+    assert resolver.resolve_many(images) == digests
+    assert not Registry.requests
+
+    # expired entries are looked up again
+    cache = digest.DigestCache(cache_file)
+    for entry in cache._entries.values():
+        entry["expires"] = 0
+    digest.DigestResolver(cache).resolve_many(images)
+    assert Registry.requests["manifest"] == 2
+
+
+class FakeService(dict):
+    @property
+    def image(self):
+        return self["image"]
+
+    def add_facet(self, data, src_ref=None):
+        self.update(data)
+
+
+def test_pin_images(registry):
+    web = FakeService(image=f"{registry}/app/web:1.0")
+    pinned = FakeService(image=f"{registry}/app/db@sha256:" + "c" * 64)
+    graph = type("Graph", (), {"services": [web, pinned, FakeService()]})
+
+    digest.pin_images(graph, digest.DigestResolver())
+    assert web.image == f"{registry}/app/web:1.0@" + Registry.digests["app/web:1.0"]
+    assert pinned.image.endswith("c" * 64)
+    assert Registry.requests["manifest"] == 1
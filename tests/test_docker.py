@@ -1,4 +1,9 @@
+import json
+import os
+
 from model import docker
+from model.runtimes.docker import Docker
+from model.utils import AttrAccess
 
 docker_tags = [
     "registry/image-name",
@@ -69,3 +74,39 @@ def test_parse_tags():
         ),
     )
 
+
+def test_parse_tag_cached_copy():
+    tag = "registry.example.com/org/cached:1.0"
+    m = docker.parse_docker_tag(tag)
+    m["version"] = "changed"
+    assert docker.parse_docker_tag(tag)["version"] == "1.0"
+    assert docker._parse_docker_tag.cache_info().hits >= 1
+
+
+def test_parse_config_cached_by_mtime(tmp_path):
+    fn = tmp_path / "config.json"
+    assert docker.parse_config(fn) is None
+
+    fn.write_text(json.dumps({"auths": {"a.example.com": {}}}))
+    cfg = docker.parse_config(fn)
+    assert docker.parse_config(fn) is cfg
+
+    fn.write_text(json.dumps({"auths": {"b.example.com": {}}}))
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert list(docker.parse_config(fn)["auths"]) == ["b.example.com"]
+
+
+def test_pull_secret_per_domain():
+    plugin = Docker()
+    plugin.graph = AttrAccess(name="g")
+    plugin.cfg = {"auths": {"r.example.com": {"auth": "x"}}, "HttpHeaders": {}}
+    plugin.auths = {"r.example.com"}
+    plugin.image_pull_secrets = {}
+
+    a = plugin.image_secrets_for("r.example.com/a:1")
+    b = plugin.image_secrets_for("r.example.com/org/b:2")
+    assert a is b
+    assert plugin.image_secrets_for("r.example.com/a:1@sha256:abc") is a
+    assert a.key == "g-r.example.com"
+    assert plugin.image_secrets_for("other.example.com/c") is None
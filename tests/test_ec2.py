@@ -0,0 +1,74 @@
+import pytest
+
+pytest.importorskip("boto3")
+
+from botocore.stub import Stubber
+
+from model import utils
+from model.runtimes import ec2
+
+
+class FakeService:
+    def __init__(self, name, runtime, tags):
+        self.name = name
+        self.runtime = runtime
+        self.tags = tags
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+def instance(ip, **tags):
+    return {
+        "PrivateIpAddress": ip,
+        "Tags": [{"Key": k, "Value": v} for k, v in tags.items()],
+    }
+
+
+@pytest.fixture
+def plugin(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    return ec2.EC2()
+
+
+def test_discovery_is_batched_and_cached(plugin):
+    runtime = utils.AttrAccess(plugins=[plugin])
+    db = FakeService("db", runtime, {"service": "db", "env": "prod"})
+    cache = FakeService("cache", runtime, {"service": "cache", "env": "prod"})
+    graph = utils.AttrAccess(name="prod", services=[db, cache])
+
+    with Stubber(plugin.ec2) as stub:
+        stub.add_response(
+            "describe_instances",
+            {
+                "Reservations": [
+                    {"Instances": [instance("10.0.0.1", service="db", env="prod")]}
+                ],
+                "NextToken": "page2",
+            },
+            {
+                "Filters": [
+                    {"Name": "tag:env", "Values": ["prod"]},
+                    {"Name": "tag:service", "Values": ["cache", "db"]},
+                ]
+            },
+        )
+        stub.add_response(
+            "describe_instances",
+            {
+                "Reservations": [
+                    {
+                        "Instances": [
+                            instance("10.0.0.2", service="db", env="prod"),
+                            instance("10.0.0.3", service="cache", env="prod"),
+                        ]
+                    }
+                ]
+            },
+        )
+        assert plugin.service_addrs(db, graph) == ["10.0.0.1", "10.0.0.2"]
+        assert plugin.service_addr(cache, graph) == "10.0.0.3"
+        assert plugin.service_addr(db, graph) == "10.0.0.1"
+        stub.assert_no_pending_responses()
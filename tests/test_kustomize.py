@@ -0,0 +1,30 @@
+import pytest
+
+from model import render
+from model import utils
+from model.runtimes import kustomize
+
+
+def test_generators_materialized_in_fini():
+    graph = utils.AttrAccess(name="blog")
+    services = [
+        utils.AttrAccess(name="ghost", files=[{"template": "overrides.conf"}]),
+        utils.AttrAccess(name="mysql", files=[]),
+    ]
+    r = render.DirectoryRenderer("/tmp/unused")
+    plugin = kustomize.Kustomize()
+    plugin.init(graph, r)
+    for s in services:
+        plugin.render_service(s, graph, r)
+    plugin.fini(graph, r)
+
+    data = r.index[plugin.fn].data
+    assert [g["name"] for g in data["configMapGenerator"]] == [
+        "ghost-config",
+        "ghost-overrides-conf",
+        "mysql-config",
+    ]
+    assert [g["name"] for g in data["secretGenerator"]] == [
+        "ghost-secrets",
+        "mysql-secrets",
+    ]
@@ -0,0 +1,64 @@
+import pytest
+
+from model import entity
+from model import model
+from model import utils
+
+
+def test_partition_values():
+    ep = model.Endpoint(name="db", service=None, interface=None, role="server")
+    ep.data.update(admin_password="testing", port="3307")
+    specs = [
+        {"name": "port", "default": "3306"},
+        {"name": "admin_user", "default": "root"},
+        {"name": "admin_password", "secret": True},
+    ]
+    public, secret = ep.partition_values(specs)
+    assert public == {"port": "3307", "admin_user": "root"}
+    assert secret == {"admin_password": "testing"}
+    assert ep.normalize_values(specs, secrets=True) == secret
+
+
+class FakeEndpoint:
+    def __init__(self, name, service, data):
+        self.name = name
+        self.service = service
+        self.interface = utils.AttrAccess(qual_name="mysql")
+        self.data = data
+        self.provides = []
+
+    def partition_values(self, specs):
+        return dict(self.data), {"password": "secret"}
+
+
+class FakeRelation:
+    name = "db"
+
+    def __init__(self, remote, local):
+        self.remote = remote
+        self.local = local
+
+    def get_remote(self, service):
+        return self.remote
+
+    def get_local(self, service):
+        return self.local
+
+
+def test_relation_views_scoped_to_render():
+    service = model.Service(name="web", entity=entity.Entity(dict(name="web")))
+    remote = FakeEndpoint("db", utils.AttrAccess(name="mysql"), {"port": "3306"})
+    relation = FakeRelation(remote, FakeEndpoint("db", service, {}))
+
+    public, secret = service.materialize_relation(relation)
+    assert public == {
+        "db": {"port": "3306", "interface": "mysql", "service_name": "mysql"}
+    }
+    assert secret["db"]["password"] == "secret"
+    # callers can't change the cached views
+    public["db"]["port"] = "1"
+    remote.data["port"] = "3307"
+    assert service.full_relation(relation)["db"]["port"] == "3306"
+    # a new render materializes them again
+    service.reset()
+    assert service.full_relation(relation)["db"]["port"] == "3307"
@@ -0,0 +1,446 @@
+import json
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import pytest
+
+from model import entity
+from model import exceptions
+from model import pipeline
+from model import trace
+
+
+@pipeline.register_class
+@dataclass
+class Recorded(pipeline.Segment):
+    """Test segment recording when it ran"""
+
+    def run(self, store, environment):
+        log = self.pipeline.log
+        with self.pipeline.lock:
+            log.append(("start", self.name))
+        time.sleep(self.get("sleep", 0))
+        with self.pipeline.lock:
+            log.append(("end", self.name))
+        self.output = f"ran {self.name}"
+        return not self.get("fail", False)
+
+
+def make_pipeline(*segments, **kwargs):
+    data = dict(name="test", kind="Pipeline", segments=list(segments), **kwargs)
+    p = pipeline.Pipeline(
+        name="test", entity=entity.Entity(data), segments=data["segments"]
+    )
+    p.log = []
+    p.lock = threading.Lock()
+    return p
+
+
+def seg(name, **kwargs):
+    return dict(name=name, kind="Recorded", **kwargs)
+
+
+def test_sequential_without_depends_on():
+    p = make_pipeline(seg("a", sleep=0.05), seg("b"), seg("c"))
+    assert p.run(None, None) == dict(a="done", b="done", c="done")
+    assert [n for e, n in p.log if e == "start"] == ["a", "b", "c"]
+    assert p.log[1] == ("end", "a")
+
+
+def test_dag_runs_independent_segments_concurrently():
+    p = make_pipeline(
+        seg("a", sleep=0.2, depends_on=[]),
+        seg("b", sleep=0.2, depends_on=[]),
+        seg("c", depends_on=["a", "b"]),
+    )
+    assert p.run(None, None) == dict(a="done", b="done", c="done")
+    # both started before either of them ended
+    assert sorted(p.log[:2]) == [("start", "a"), ("start", "b")]
+    assert p.log[-2:] == [("start", "c"), ("end", "c")]
+
+
+def test_failure_policies():
+    segments = [
+        seg("bad", fail=True, depends_on=[]),
+        seg("after", depends_on="bad"),
+        seg("other", sleep=0.05, depends_on=[]),
+        seg("later", depends_on="other"),
+    ]
+    p = make_pipeline(*segments)
+    status = p.run(None, None, max_workers=1)
+    assert status == dict(
+        bad="failed", after="skipped", other="skipped", later="skipped"
+    )
+
+    p = make_pipeline(*segments)
+    status = p.run(None, None, on_failure=pipeline.CONTINUE)
+    assert status == dict(bad="failed", after="skipped", other="done", later="done")
+
+
+def test_dependency_errors():
+    p = make_pipeline(seg("a", depends_on="b"), seg("b", depends_on="a"))
+    with pytest.raises(exceptions.ConfigurationError):
+        p.run(None, None)
+
+    p = make_pipeline(seg("a", depends_on="missing"))
+    with pytest.raises(exceptions.ConfigurationError):
+        p.run(None, None)
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    """Install fake commands on PATH.
+
+    Each is a python script whose body is formatted with state, the
+    directory it can record its calls in (returned by the installer).
+    """
+    bindir = tmp_path / "bin"
+    bindir.mkdir()
+    monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+
+    def install(name, body):
+        fn = bindir / name
+        fn.write_text(f"#!{sys.executable}\n" + body.format(state=str(tmp_path)))
+        fn.chmod(0o755)
+        return tmp_path
+
+    return install
+
+
+FAKE_KUBECTL = """
+import sys, yaml
+with open({state!r} + "/calls", "a") as fp:
+    fp.write(" ".join(sys.argv[1:]) + "\\n")
+failed = False
+for doc in yaml.safe_load_all(sys.stdin):
+    name = doc["metadata"]["name"]
+    if "bad" in name:
+        print(f'Error from server: error when creating "STDIN": "{{name}}" is invalid',
+              file=sys.stderr)
+        failed = True
+    else:
+        print(f"{{doc['kind'].lower()}}.apps/{{name}}")
+sys.exit(1 if failed else 0)
+"""
+
+
+class FakeEnvironment:
+    def __init__(self, text):
+        self.text = text
+
+    def get_template(self, name):
+        return self
+
+    def render(self, context):
+        return self.text
+
+
+def manifest(*names):
+    return "\n---\n".join(
+        f"kind: Deployment\nmetadata:\n  name: {name}\n" for name in names
+    )
+
+
+def test_manifest_batched_apply(fake_bin, caplog):
+    kubectl = fake_bin("kubectl", FAKE_KUBECTL) / "calls"
+    env = FakeEnvironment(manifest(*[f"app{i}" for i in range(10)]))
+    p = make_pipeline(dict(name="m", kind="KubernetesManifest", template="t"))
+    assert p.run(None, env) == dict(m="done")
+    assert kubectl.read_text().splitlines() == ["apply -f - -o name"]
+
+    kubectl.unlink()
+    env = FakeEnvironment(manifest("app0", "bad1", "app2", "bad3", "app4"))
+    p = make_pipeline(
+        dict(name="m", kind="KubernetesManifest", template="t", batch_size=2)
+    )
+    assert p.run(None, env) == dict(m="failed")
+    assert len(kubectl.read_text().splitlines()) == 3
+    failed = [r.message for r in caplog.records if "failed:" in r.message]
+    assert len(failed) == 2
+    assert "deployment/bad1" in failed[0] and '"bad1" is invalid' in failed[0]
+    assert "deployment/bad3" in failed[1]
+
+
+FAKE_EKS = """
+import json, sys, time
+from pathlib import Path
+
+state = Path({state!r})
+args = sys.argv[1:]
+with open(state / "calls", "a") as fp:
+    fp.write(" ".join(args) + "\\n")
+if args[0] == "get":
+    # kubectl get nodes -l <label>=<ng> -o json
+    ng = args[3].partition("=")[2]
+    ready = (state / ng).exists()
+    items = [
+        dict(status=dict(conditions=[dict(type="Ready", status="True")]))
+    ] if ready else []
+    print(json.dumps(dict(items=items)))
+elif args[0] in ("create", "delete"):
+    start = time.time()
+    if args[0] == "create":
+        sys.stdin.read()
+    time.sleep(0.3)
+    if args[0] == "create":
+        (state / args[-1].split("=")[1].strip("'")).touch()
+    with open(state / "spans", "a") as fp:
+        fp.write(json.dumps([args[0], start, time.time()]) + "\\n")
+"""
+
+
+def test_roll_nodegroups_in_parallel(fake_bin):
+    for tool in ["eksctl", "kubectl"]:
+        state = fake_bin(tool, FAKE_EKS)
+
+    p = make_pipeline(
+        dict(name="roll", kind="Eksctl", max_parallel=3, poll_interval=0.05)
+    )
+    segment = p.segments[0]
+    namemap = {f"ng-{i}": f"ng-{i + 3}" for i in range(3)}
+    config = dict(
+        metadata=dict(name="cluster"),
+        nodeGroups=[dict(name=new, desiredCapacity=1) for new in namemap.values()],
+    )
+    assert segment._roll_nodegroups(config, namemap)
+    spans = [json.loads(line) for line in (state / "spans").read_text().splitlines()]
+    for action in ("create", "delete"):
+        times = [(start, end) for a, start, end in spans if a == action]
+        assert len(times) == 3
+        # the nodegroups were replaced at once
+        assert max(s for s, _ in times) < min(e for _, e in times)
+
+    calls = (state / "calls").read_text().splitlines()
+    deletes = [c for c in calls if c.startswith("delete")]
+    assert sorted(deletes) == [
+        f"delete nodegroup -w --approve --cluster=cluster ng-{i}" for i in range(3)
+    ]
+
+
+def test_unchanged_segments_are_skipped(tmp_path):
+    state = pipeline.PipelineState(tmp_path / "state.json")
+    segments = [seg("a"), seg("b", fail=True), seg("c", depends_on=["a"])]
+    p = make_pipeline(*segments, on_failure=pipeline.CONTINUE)
+    assert p.run(None, None, state=state) == dict(a="done", b="failed", c="done")
+
+    # a fresh run (and state) only retries what failed or changed
+    state = pipeline.PipelineState(tmp_path / "state.json")
+    segments[2]["note"] = "changed"
+    p = make_pipeline(*segments, on_failure=pipeline.CONTINUE)
+    status = p.run(None, None, state=state)
+    assert status == dict(a="unchanged", b="failed", c="done")
+    assert [n for e, n in p.log if e == "start"] == ["b", "c"]
+
+    p = make_pipeline(*segments, on_failure=pipeline.CONTINUE)
+    status = p.run(None, None, state=state, force=True)
+    assert status == dict(a="done", b="failed", c="done")
+
+
+def test_unstable_inputs_always_run(tmp_path):
+    state = pipeline.PipelineState(tmp_path / "state.json")
+    for _ in range(2):
+        p = make_pipeline(seg("a"))
+        # repr() of the object would differ between runs
+        p.segments[0]._inputs = lambda store, environment: object()
+        assert p.segments[0].fingerprint(None, None) is None
+        assert p.run(None, None, state=state) == dict(a="done")
+
+
+def test_resume_from_checkpoint(tmp_path):
+    state = pipeline.PipelineState(tmp_path / "state.json")
+    segments = [
+        seg("a", always_run=True),
+        seg("b", always_run=True, fail=True),
+        seg("c", always_run=True),
+    ]
+    p = make_pipeline(*segments)
+    assert p.run(None, None, state=state) == dict(a="done", b="failed", c="skipped")
+    assert list(state.checkpointed()) == ["a"]
+
+    segments[1]["fail"] = False
+    p = make_pipeline(*segments)
+    state = pipeline.PipelineState(tmp_path / "state.json")
+    status = p.run(None, None, state=state, resume=True)
+    assert status == dict(a="resumed", b="done", c="done")
+    assert [n for e, n in p.log if e == "start"] == ["b", "c"]
+    assert p.segments[0].output == "ran a"
+    # a completed run leaves nothing to resume
+    assert not state.checkpointed()
+
+
+def test_trace_spans(tmp_path):
+    tracer = trace.Tracer(tmp_path / "trace.jsonl", pipeline="test")
+    p = make_pipeline(
+        dict(name="s", kind="Script", commands=["echo hello", "exit 2"]),
+        seg("after"),
+    )
+    assert p.run(None, None, tracer=tracer) == dict(s="failed", after="skipped")
+    spans = [json.loads(line) for line in tracer.path.read_text().splitlines()]
+    assert [(s["type"], s["name"]) for s in spans] == [
+        ("command", "echo hello"),
+        ("command", "exit 2"),
+        ("segment", "s"),
+    ]
+    assert spans[0]["exit_code"] == 0 and spans[0]["output_bytes"] == 6
+    assert spans[1]["exit_code"] == 2 and spans[1]["status"] == "error"
+    assert spans[2]["status"] == "failed"
+    assert all(s["pipeline"] == "test" and s["end"] >= s["start"] for s in spans)
+
+    summary = tracer.summary().splitlines()
+    assert summary[0].split()[:4] == ["segment", "status", "seconds", "commands"]
+    assert summary[1].split()[:2] == ["s", "failed"]
+    assert summary[1].split()[-2:] == ["2", "6"]
+    assert summary[-1].startswith("total")
+
+
+FAKE_CLUSTER = """
+import json, sys, yaml
+with open({state!r} + "/calls", "a") as fp:
+    fp.write(" ".join(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "get" and "/" in sys.argv[-1]:
+    name = sys.argv[-1].partition("/")[2]
+    md = dict(name=name, uid="x", resourceVersion="2")
+    print(json.dumps(dict(kind="ConfigMap", metadata=md, data={{}})))
+elif sys.argv[1] == "get" and sys.argv[3] == "locked":
+    print("configmaps is forbidden: cannot list resource", file=sys.stderr)
+    sys.exit(1)
+elif sys.argv[1] == "get":
+    items = [
+        dict(
+            kind="ConfigMap",
+            metadata=dict(name=f"cm{{i}}", uid=str(i), resourceVersion="1"),
+            data={{}},
+        )
+        for i in range(50)
+    ]
+    print(json.dumps(dict(kind="List", items=items)))
+elif sys.argv[1] == "replace":
+    doc = yaml.safe_load(sys.stdin)
+    md = doc["metadata"]
+    # cm49 was changed by someone else since it was listed
+    if md["name"] == "cm49" and md["resourceVersion"] == "1":
+        print('configmaps "cm49": the object has been modified', file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(doc))
+"""
+
+
+def patch_segment(name, resource, key, **kwargs):
+    return dict(
+        name=name,
+        kind="KubernetesManifest",
+        action="patch",
+        template="t",
+        resource=resource,
+        config=key,
+        **kwargs,
+    )
+
+
+class PatchEnvironment(FakeEnvironment):
+    def __init__(self):
+        super().__init__(None)
+
+    def render(self, context):
+        key = context["segment"]
+        return f"config:\n  - path: data\n    data:\n      {key}: 'yes'\n"
+
+
+def make_patch_pipeline(*segments):
+    p = make_pipeline(*segments)
+    for s in p.segments:
+        s._context = lambda store, env, s=s: dict(segment=s.get("config"))
+    return p
+
+
+def test_patch_from_cluster_snapshot(fake_bin):
+    calls = fake_bin("kubectl", FAKE_CLUSTER) / "calls"
+    segments = [patch_segment(f"p{i}", f"configmap/cm{i}", "a") for i in range(10)]
+    segments.append(patch_segment("again", "configmap/cm0", "b"))
+    p = make_patch_pipeline(*segments)
+    assert set(p.run(None, PatchEnvironment()).values()) == {"done"}
+
+    lines = calls.read_text().splitlines()
+    assert lines.count("get -n default -o json configmap") == 1
+    assert len(lines) == 12
+    # the second patch of cm0 sees the first one
+    cm0 = p.cluster.get(p.segments[-1], "configmap/cm0")
+    assert cm0["data"] == {"a": "yes", "b": "yes"}
+    # cluster reads and writes aren't recorded as the segment's output
+    assert p.segments[-1].output is None
+
+
+def test_patch_retries_on_conflict(fake_bin):
+    calls = fake_bin("kubectl", FAKE_CLUSTER) / "calls"
+    p = make_patch_pipeline(patch_segment("p", "configmap/cm49", "a"))
+    assert p.run(None, PatchEnvironment()) == {"p": "done"}
+
+    lines = calls.read_text().splitlines()
+    assert lines == [
+        "get -n default -o json configmap",
+        "replace -n default -f - -o json",
+        "get -n default -o json configmap/cm49",
+        "replace -n default -f - -o json",
+    ]
+    cm49 = p.cluster.get(p.segments[0], "configmap/cm49")
+    assert cm49["metadata"]["resourceVersion"] == "2"
+    assert cm49["data"] == {"a": "yes"}
+
+
+def test_patch_without_list_permission(fake_bin):
+    calls = fake_bin("kubectl", FAKE_CLUSTER) / "calls"
+    p = make_patch_pipeline(
+        patch_segment("p0", "configmap/cm0", "a", namespace="locked"),
+        patch_segment("p1", "configmap/cm1", "a", namespace="locked"),
+    )
+    assert p.run(None, PatchEnvironment()) == dict(p0="done", p1="done")
+
+    lines = calls.read_text().splitlines()
+    assert lines == [
+        "get -n locked -o json configmap",
+        "get -n locked -o json configmap/cm0",
+        "replace -n locked -f - -o json",
+        "get -n locked -o json configmap/cm1",
+        "replace -n locked -f - -o json",
+    ]
+
+
+def test_cluster_snapshot_dropped_after_writing_segment(fake_bin):
+    calls = fake_bin("kubectl", FAKE_CLUSTER) / "calls"
+    p = make_patch_pipeline(
+        patch_segment("p0", "configmap/cm0", "a"),
+        seg("script"),
+        patch_segment("p1", "configmap/cm1", "a"),
+    )
+    assert set(p.run(None, PatchEnvironment()).values()) == {"done"}
+
+    lines = calls.read_text().splitlines()
+    assert lines.count("get -n default -o json configmap") == 2
+
+
+def test_fingerprint_covers_environment_and_pipeline():
+    class Environment:
+        def __init__(self, **config):
+            data = dict(name="dev", kind="Environment", config=config)
+            self.entity = entity.Entity(data)
+
+    p = make_pipeline(seg("a"))
+    segment = p.segments[0]
+    first = segment.fingerprint(None, Environment(region="a"))
+    assert segment.fingerprint(None, Environment(region="a")) == first
+    assert segment.fingerprint(None, Environment(region="b")) != first
+
+    other = make_pipeline(seg("a"), max_workers=2).segments[0]
+    assert other.fingerprint(None, Environment(region="a")) != first
+    # other segments of the pipeline don't change it
+    other = make_pipeline(seg("a"), seg("b")).segments[0]
+    assert other.fingerprint(None, Environment(region="a")) == first
+
+
+def test_output_of_last_command():
+    p = make_pipeline(dict(name="s", kind="Script", commands=["echo 1", "echo 2"]))
+    assert p.run(None, None) == dict(s="done")
+    assert p.segments[0].output == "2\n"
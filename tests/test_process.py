@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from model import process
+
+
+def test_streams_lines():
+    lines = []
+    result = process.run(
+        "cat; echo done >&2",
+        input="one\ntwo\npartial",
+        on_stdout=lines.append,
+        on_stderr=lines.append,
+    )
+    assert result.returncode == 0
+    assert result.stdout == "one\ntwo\npartial"
+    assert result.stderr == "done\n"
+    assert sorted(lines) == ["done", "one", "partial", "two"]
+    assert result.output_bytes == len("one\ntwo\npartial") + len("done\n")
+
+
+def test_bounded_capture(monkeypatch):
+    monkeypatch.setattr(process, "CHUNK_SIZE", 1024)
+    script = "import sys; sys.stdout.write('x' * 100000 + 'tail')"
+    result = process.run([sys.executable, "-c", script], max_capture=4096)
+    assert result.truncated
+    assert len(result.stdout) < 100000
+    assert result.stdout.endswith("tail")
+    assert result.output_bytes == 100004
+
+
+def test_large_input():
+    # cat writes its output back while its input is still being fed
+    result = process.run("cat", input="x" * 1000000, timeout=30)
+    assert result.returncode == 0
+    assert len(result.stdout) == 1000000
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    try:
+        with open(f"/proc/{pid}/stat") as fp:
+            # a zombie waiting to be reaped is gone as well
+            return fp.read().rpartition(")")[2].split()[0] != "Z"
+    except OSError:
+        return True
+
+
+def test_timeout_terminates_children():
+    with pytest.raises(subprocess.TimeoutExpired) as e:
+        process.run("sleep 30 & echo $!; wait", timeout=0.5)
+    child = int(e.value.output)
+    for _ in range(50):
+        if not alive(child):
+            break
+        time.sleep(0.1)
+    assert not alive(child)
+    assert not process._live
+
+
+def test_run_many_concurrently():
+    stamps = "date +%s.%N; sleep 0.3; date +%s.%N"
+    results = process.run_many(
+        [
+            (stamps, {}),
+            (f"{stamps}; exit 3", {}),
+            ("sleep 5", {"timeout": 0.2}),
+        ],
+        max_concurrency=3,
+    )
+    spans = [[float(t) for t in r.stdout.split()] for r in results[:2]]
+    # each started before the other finished
+    assert max(s for s, _ in spans) < min(e for _, e in spans)
+    assert results[1].returncode == 3
+    assert isinstance(results[2], subprocess.TimeoutExpired)
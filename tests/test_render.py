@@ -1,4 +1,5 @@
 import pytest
+import yaml
 
 from model import render
 from model.runtimes import kubernetes
@@ -18,3 +19,40 @@ def test_pick_plugin():
     r.add("02", dict(this="another"), kubernetes.Kubernetes(), foo="baz")
     result = r.pick(plugin=kubernetes.Kubernetes())
     assert len(list(result)) == 2
+
+
+def test_diff_renderer(tmp_path):
+    prev = render.DirectoryRenderer(tmp_path / "prev")
+    prev.add("01.yaml", dict(this="test"), kubernetes.Kubernetes())
+    prev.add("02.yaml", dict(this="another"), kubernetes.Kubernetes())
+    prev.add("03.json", dict(a=1, b=2), kubernetes.Kubernetes(), format="json")
+    prev.write()
+
+    r = render.DiffRenderer(tmp_path / "out", previous=tmp_path / "prev")
+    r.add("01.yaml", dict(this="test"), kubernetes.Kubernetes())
+    r.add("03.json", dict(b=2, a=1), kubernetes.Kubernetes(), format="json")
+    r.add("04.yaml", dict(this="new"), kubernetes.Kubernetes())
+    summary = r.write()
+    assert summary == dict(
+        added=["04.yaml"], changed=[], removed=["02.yaml"], unchanged=2
+    )
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == [
+        ".model-diff.yaml",
+        "04.yaml",
+    ]
+
+
+def test_diff_renderer_stdout(tmp_path, capsys):
+    prev = render.DirectoryRenderer(tmp_path / "prev")
+    prev.add("01.yaml", dict(this="test"), kubernetes.Kubernetes())
+    prev.write()
+
+    r = render.DiffRenderer("-", previous=tmp_path / "prev")
+    r.add("01.yaml", dict(this="changed"), kubernetes.Kubernetes())
+    r.add("02.json", dict(a=1), kubernetes.Kubernetes(), format="json")
+    r.write()
+    out = capsys.readouterr().out
+    assert out.startswith("---\nthis: changed\n---\n{\n")
+    docs = list(yaml.safe_load_all(out))
+    assert docs == [dict(this="changed"), dict(a=1)]
+    assert "# changed:\n# - 01.yaml\n" in out
@@ -0,0 +1,69 @@
+import subprocess
+import sys
+
+import pytest
+
+from model import exceptions
+from model import runtime
+from model import utils
+
+
+class CountingService:
+    def __init__(self):
+        self.calls = 0
+
+    def full_config(self):
+        self.calls += 1
+        return {"environment": [{"name": "url", "value": "http://example.com"}]}
+
+
+def test_render_context_resolves_once():
+    s = CountingService()
+    ctx = runtime.render_context(s)
+    assert runtime.render_context(s) is ctx
+    ctx.config
+    ctx.config
+    assert ctx.environment[0]["name"] == "url"
+    assert s.calls == 1
+
+
+def test_lookup_plugin_imports_only_requested():
+    code = (
+        "import sys\n"
+        "from model import runtime\n"
+        "cls = runtime.lookup_plugin('Kubernetes')\n"
+        "assert cls.__name__ == 'Kubernetes'\n"
+        "assert 'model.runtimes.ec2' not in sys.modules\n"
+        "assert 'model.runtimes.vault' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_lookup_unknown_plugin():
+    with pytest.raises(exceptions.ConfigurationError):
+        runtime.lookup_plugin("no-such-plugin")
+
+
+class AddrPlugin(runtime.RuntimePlugin):
+    def __init__(self):
+        super().__init__(name="addr")
+        self.calls = 0
+
+    def service_addr(self, service, graph):
+        self.calls += 1
+        return f"{service.name}.{graph.name}"
+
+
+def test_runtime_memoizes_service_addr():
+    plugin = AddrPlugin()
+    rt = runtime.RuntimeImpl("test", plugins=[plugin])
+    graph = utils.AttrAccess(name="blog")
+    service = utils.AttrAccess(name="db")
+    assert rt.service_addr(service, graph) == "db.blog"
+    assert rt.service_addr(service, graph) == "db.blog"
+    assert plugin.calls == 1
+    with pytest.raises(AttributeError):
+        rt.service_addrs(service, graph)
+    rt.reset()
+    rt.service_addr(service, graph)
+    assert plugin.calls == 2
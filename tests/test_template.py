@@ -0,0 +1,130 @@
+import os
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from model import template
+
+
+def test_shared_env_reloads_on_mtime(tmp_path):
+    fn = tmp_path / "hello.txt"
+    fn.write_text("hello {{ name }}")
+    uri = f"file://{fn}"
+    env = template.get_env()
+    assert env is template.get_env()
+
+    t = env.get_template(uri)
+    assert env.get_template(uri) is t
+    assert t.render(name="world") == "hello world"
+
+    fn.write_text("goodbye {{ name }}")
+    st = os.stat(fn)
+    os.utime(fn, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert env.get_template(uri).render(name="world") == "goodbye world"
+
+
+class TemplateHost(BaseHTTPRequestHandler):
+    body = "v1 {{ name }}"
+    etag = '"v1"'
+    requests = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if "missing" in self.path:
+            self.requests["404"] += 1
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == self.etag:
+            self.requests["304"] += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.requests["200"] += 1
+        data = self.body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def host():
+    TemplateHost.requests.clear()
+    TemplateHost.body = "v1 {{ name }}"
+    TemplateHost.etag = '"v1"'
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TemplateHost)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_env_revalidates_etag(host):
+    env = template.get_env()
+    uri = f"{host}/etag.txt"
+    assert env.get_template(uri).render(name="a") == "v1 a"
+    assert env.get_template(uri).render(name="a") == "v1 a"
+    assert TemplateHost.requests == {"200": 1, "304": 1}
+
+    TemplateHost.body = "v2 {{ name }}"
+    TemplateHost.etag = '"v2"'
+    assert env.get_template(uri).render(name="a") == "v2 a"
+
+
+def test_http_cache_revalidates_across_runs(host, tmp_path):
+    uri = f"{host}/cached.txt"
+    first = template.Fetcher(template.HTTPCache(tmp_path))
+    assert first.get(uri) == "v1 {{ name }}"
+
+    # a later run only revalidates its on disk copy
+    second = template.Fetcher(template.HTTPCache(tmp_path))
+    assert second.get(uri) == "v1 {{ name }}"
+    assert TemplateHost.requests == {"200": 1, "304": 1}
+
+
+def test_prefetch_serves_render(host):
+    loader = template.URILoader()
+    env = template.Environment(loader=loader)
+    uris = [f"{host}/t{i}.txt" for i in range(4)] + [f"{host}/missing.txt"]
+    loader.fetcher.prefetch(uris)
+    assert TemplateHost.requests == {"200": 4, "404": 1}
+
+    t = env.select_template([f"{host}/missing.txt", f"{host}/t2.txt"])
+    assert t.render(name="a") == "v1 a"
+    assert env.get_template(f"{host}/t0.txt").render(name="b") == "v1 b"
+    assert TemplateHost.requests == {"200": 4, "404": 1}
+
+
+@pytest.fixture
+def bytecode_dir(tmp_path):
+    path = tmp_path / "bytecode"
+    template.enable_bytecode_cache(path)
+    yield path
+    template.disable_bytecode_cache()
+
+
+def test_bytecode_cache_skips_compile(tmp_path, bytecode_dir):
+    fn = tmp_path / "compiled.txt"
+    fn.write_text("compiled {{ name }}")
+    uri = f"file://{fn}"
+    assert template.get_env().get_template(uri).render(name="a") == "compiled a"
+    assert len(list(bytecode_dir.iterdir())) == 1
+
+    # a fresh process (environment) loads the code from disk
+    env = template.Environment(
+        loader=template.URILoader(),
+        bytecode_cache=template.get_env().bytecode_cache,
+    )
+
+    def compile(*args, **kwargs):
+        raise AssertionError("template compiled again")
+
+    env.compile = compile
+    assert env.get_template(uri).render(name="b") == "compiled b"
@@ -0,0 +1,103 @@
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+hvac = pytest.importorskip("hvac")
+
+from model import entity
+from model import utils
+from model.runtimes import vault
+
+SECRETS = {
+    "db": {"password": "hunter2"},
+    "api": {"token": "abc"},
+}
+
+
+class FakeVault(BaseHTTPRequestHandler):
+    requests = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/v1/auth/token/lookup-self":
+            return self._reply(200, {"data": {"id": "test"}})
+        prefix = "/v1/secret/"
+        if self.path.startswith(prefix):
+            name = self.path[len(prefix) :]
+            self.requests[name] += 1
+            if name in SECRETS:
+                return self._reply(200, {"data": SECRETS[name]})
+        self._reply(404, {"errors": []})
+
+
+@pytest.fixture
+def proxy():
+    FakeVault.requests.clear()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVault)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield vault.VaultProxy(url=url, token="test")
+    server.shutdown()
+    server.server_close()
+
+
+def test_secrets_are_cached(proxy):
+    assert proxy["kv:db"].password == "hunter2"
+    assert proxy["kv:db"].password == "hunter2"
+    assert proxy["db"].password == "hunter2"
+    assert FakeVault.requests["db"] == 2  # 'db' and 'kv:db' are cached apart
+
+
+def test_cache_ttl(proxy):
+    proxy.ttl = -1
+    proxy["kv:db"]
+    proxy["kv:db"]
+    assert FakeVault.requests["db"] == 2
+
+
+def test_prefetch(proxy):
+    env = {"config": {"password": "{vault['kv:db'].password}"}}
+    svc = ['{vault["kv:api"].token}', "{vault['kv:db'].password}"]
+    paths = vault.find_vault_paths([env, svc])
+    assert paths == {"kv:db", "kv:api"}
+    proxy.prefetch(paths)
+    assert proxy["kv:api"].token == "abc"
+    assert proxy["kv:db"].password == "hunter2"
+    assert FakeVault.requests == {"db": 1, "api": 1}
+
+
+def test_prefetch_is_best_effort(proxy):
+    proxy.prefetch({"kv:db", "kv:missing"})
+    assert FakeVault.requests == {"db": 1, "missing": 1}
+    assert proxy["kv:db"].password == "hunter2"
+    # the unreadable secret only fails when it is used
+    with pytest.raises(hvac.exceptions.InvalidPath):
+        proxy["kv:missing"]
+
+
+def test_init_prefetches_the_graph(proxy):
+    plugin = vault.Vault()
+    plugin.client = proxy
+    config = {"db": "{vault['kv:db']}", "unused": "{vault['kv:missing']}"}
+    environment = entity.Entity(dict(name="dev", kind="Environment", config=config))
+    web = entity.Entity(dict(name="web", kind="Component", token="{vault['kv:api']}"))
+    graph = utils.AttrAccess(environment=environment, services=[web])
+    # the secret that can't be read doesn't stop the render
+    plugin.init(graph, None)
+    assert FakeVault.requests == {"db": 1, "api": 1, "missing": 1}
+    assert proxy["kv:api"].token == "abc"
+    assert FakeVault.requests["api"] == 1